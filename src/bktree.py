@@ -0,0 +1,139 @@
+import os
+import logging
+from bisect import bisect_left, bisect_right
+import numpy as np
+import Levenshtein
+
+
+class BKTree:
+
+    def __init__(self, index, nodes, child_offsets, child_dists, child_nodes, path=None):
+        """Burkhard-Keller tree over the names of a NameIndex
+
+        Finds all names with minimum Levenshtein distance to a query without
+        comparing against every name. Node i holds the name at position
+        nodes[i] of the index, its children are
+        child_nodes[child_offsets[i]:child_offsets[i+1]], sorted by their
+        distance child_dists[...] to the parent, node 0 is the root.
+
+        Args:
+            index (NameIndex): the names the tree was built over
+            nodes (np.array): int32, name positions in the index
+            child_offsets (np.array): int64
+            child_dists (np.array): int32
+            child_nodes (np.array): int32
+            path (string): directory the arrays were loaded from, if any
+        """
+        self.index = index
+        self.nodes = nodes
+        self.child_offsets = child_offsets
+        self.child_dists = child_dists
+        self.child_nodes = child_nodes
+        self.path = path
+        return None
+
+    @classmethod
+    def build(cls, index, seed=42):
+        """Builds the tree, names are inserted in a fixed random order
+
+        Args:
+            index (NameIndex): name index
+            seed (int): seed for the insertion order
+        Returns:
+            BKTree
+        """
+        logging.info("building bk-tree over {} names...".format(len(index)))
+        order = np.random.RandomState(seed).permutation(len(index)).astype(np.int32)
+        words = []
+        children = {}
+        for c, pos in enumerate(order):
+            word = index.name(pos)
+            words.append(word)
+            if c == 0:
+                continue
+            node = 0
+            while True:
+                d = Levenshtein.distance(word, words[node])
+                child = children.get((node, d))
+                if child is None:
+                    children[(node, d)] = c
+                    break
+                node = child
+            if c % 100000 == 0:
+                logging.info("{}/{} names inserted into bk-tree".format(c, len(index)))
+
+        edges = sorted(children.items())
+        counts = np.bincount([parent for (parent, _), _ in edges], minlength=len(order))
+        child_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        child_dists = np.array([d for (_, d), _ in edges], dtype=np.int32)
+        child_nodes = np.array([child for _, child in edges], dtype=np.int32)
+        logging.info("bk-tree finished")
+        return cls(index, order, child_offsets, child_dists, child_nodes)
+
+    def save(self, path):
+        """writes the arrays to a directory, load with BKTree.load"""
+
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "nodes.npy"), self.nodes)
+        np.save(os.path.join(path, "child_offsets.npy"), self.child_offsets)
+        np.save(os.path.join(path, "child_dists.npy"), self.child_dists)
+        np.save(os.path.join(path, "child_nodes.npy"), self.child_nodes)
+        return None
+
+    @classmethod
+    def load(cls, index, path):
+        """memory maps a tree written with save, index must be the
+        NameIndex the tree was built over"""
+
+        load = lambda name: np.asarray(np.load(os.path.join(path, name + ".npy"), mmap_mode="r"))
+        return cls(index
+                , load("nodes")
+                , load("child_offsets")
+                , load("child_dists")
+                , load("child_nodes")
+                , path=path)
+
+    def __reduce__(self):
+        if self.path:
+            return (BKTree.load, (self.index, self.path))
+        return (BKTree, (self.index, self.nodes, self.child_offsets
+            , self.child_dists, self.child_nodes))
+
+    def nearest(self, name):
+        """Returns all names with minimum Levenshtein distance to name
+
+        Args:
+            name (string): query
+        Returns:
+            list with names, all have the same (minimal) distance
+            to the query
+        """
+        if not len(self.nodes):
+            return []
+        best = np.iinfo(np.int32).max
+        found = []
+        #stack with (node, lower bound of its distance to the query)
+        stack = [(0, 0)]
+        while stack:
+            node, lower = stack.pop()
+            if lower > best:
+                continue
+            word = self.index.name(int(self.nodes[node]))
+            d = Levenshtein.distance(name, word)
+            if d < best:
+                best = d
+                found = [word]
+            elif d == best:
+                found.append(word)
+            start, end = self.child_offsets[node], self.child_offsets[node + 1]
+            if start == end:
+                continue
+            #children with |d - edge| <= best may contain ties
+            dists = self.child_dists[start:end].tolist()
+            lo = bisect_left(dists, d - best)
+            hi = bisect_right(dists, d + best)
+            children = self.child_nodes[start + lo:start + hi].tolist()
+            #most promising children (edge close to d) are visited first
+            for k in sorted(range(hi - lo), key=lambda k: -abs(d - dists[lo + k])):
+                stack.append((children[k], abs(d - dists[lo + k])))
+        return found
@@ -0,0 +1,168 @@
+import os
+import json
+import sqlite3
+import logging
+
+
+class CandidateStore:
+
+    def __init__(self, path, snapshot):
+        """Persistent map place name ---> list with geonameid candidates
+
+        Backed by a sqlite file. Every entry remembers the geonames snapshot
+        it was computed with, entries of other snapshots count as missing
+        and are overwritten.
+
+        Args:
+            path (string): path to the sqlite file
+            snapshot (string): id of the geonames snapshot,
+                see geohelpers.geo_names_snapshot
+        """
+        self.path = path
+        self.snapshot = snapshot
+        self.con = sqlite3.connect(path)
+        self.con.execute("CREATE TABLE IF NOT EXISTS candidates ("
+                "name TEXT PRIMARY KEY"
+                ", snapshot TEXT NOT NULL"
+                ", candidates TEXT NOT NULL)")
+        self.con.commit()
+        return None
+
+    def get_many(self, names, chunk_size=500):
+        """returns a dict with the stored candidates of those names that
+        are stored for the current snapshot"""
+
+        names = list(names)
+        out = {}
+        for i in range(0, len(names), chunk_size):
+            chunk = names[i:i+chunk_size]
+            rows = self.con.execute("SELECT name, candidates FROM candidates "
+                    "WHERE snapshot = ? AND name IN ({})".format(",".join("?" * len(chunk)))
+                    , [self.snapshot] + chunk)
+            for name, candidates in rows:
+                out[name] = json.loads(candidates)
+        return out
+
+    def put_many(self, C):
+        """stores (or replaces) the candidates of all names in C"""
+
+        self.con.executemany("INSERT OR REPLACE INTO candidates VALUES (?, ?, ?)"
+                , [(name, self.snapshot, json.dumps(candidates))
+                    for name, candidates in C.items()])
+        self.con.commit()
+        return None
+
+    def clear(self):
+        """removes all entries"""
+
+        self.con.execute("DELETE FROM candidates")
+        self.con.commit()
+        return None
+
+    def drop_outdated(self):
+        """removes the entries of other snapshots"""
+
+        n = self.con.execute("DELETE FROM candidates WHERE snapshot != ?"
+                , [self.snapshot]).rowcount
+        self.con.commit()
+        logging.info("removed {} outdated candidate entries from {}".format(n, self.path))
+        return None
+
+    def close(self):
+        self.con.close()
+        return None
+
+
+class CandidateLog:
+
+    def __init__(self, path, snapshot="", flush_every=100):
+        """Append-only json lines log of computed candidates
+
+        Used as checkpoint of long candidate retrievals: results are
+        appended every flush_every names, a restarted run reads the log
+        and skips all names found in it. The first line holds the geonames
+        snapshot the candidates were computed with, a log of another
+        snapshot is discarded.
+
+        Args:
+            path (string): path to the log file
+            snapshot (string): id of the geonames snapshot,
+                see geohelpers.geo_names_snapshot
+            flush_every (int): number of names after which buffered results
+                are written and synced to disk
+        """
+        self.path = path
+        self.snapshot = snapshot
+        self.flush_every = flush_every
+        self.buffer = []
+        self.f = None
+        return None
+
+    def read(self):
+        """Returns the dict name ---> candidates stored in the log. A 
+        truncated last line (crash while writing) is cut off, a log of
+        another snapshot is removed."""
+
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        good = 0
+        with open(self.path, "rb") as f:
+            for i, line in enumerate(f):
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if i == 0:
+                    if entry.get("snapshot") != self.snapshot:
+                        logging.warning("{} was written for another geonames snapshot,\
+                                discarding it".format(self.path))
+                        f.close()
+                        self.clear()
+                        return done
+                else:
+                    done[entry["name"]] = entry["candidates"]
+                good += len(line)
+        if good != os.path.getsize(self.path):
+            logging.warning("cutting off incomplete entry at the end of {}".format(self.path))
+            with open(self.path, "r+b") as f:
+                f.truncate(good)
+        logging.info("{} names with candidates found in {}".format(len(done), self.path))
+        return done
+
+    def add(self, name, candidates):
+        self.buffer.append(json.dumps({"name": name, "candidates": candidates}) + "\n")
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+        return None
+
+    def flush(self):
+        if self.f is None:
+            new = not os.path.exists(self.path) or not os.path.getsize(self.path)
+            self.f = open(self.path, "a")
+            if new:
+                self.f.write(json.dumps({"snapshot": self.snapshot}) + "\n")
+        self.f.write("".join(self.buffer))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.buffer = []
+        return None
+
+    def close(self):
+        self.flush()
+        self.f.close()
+        self.f = None
+        return None
+
+    def clear(self):
+        """removes the log (and drops buffered results)"""
+
+        self.buffer = []
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        return None
@@ -3,6 +3,8 @@ from collections import defaultdict
 from bs4 import BeautifulSoup
 import xml.etree.ElementTree as ET
 import os
+import calendar
+import datetime
 import _pickle
 import spacy
 import logging
@@ -179,6 +181,59 @@ def extract_date(et):
     return fromto
 
 
+def date_to_day(string, end=False):
+    """Converts a date string of the RI (e.g. 1190-03-05) to a day number
+    (proleptic gregorian ordinal). Unknown month or day (00) count as the
+    first one, or as the last one if end is set.
+
+    >>> date_to_day("1190-03-05") - date_to_day("1190-03-01")
+    4
+    >>> date_to_day("1190-00-00", end=True) - date_to_day("1190-00-00")
+    364
+    >>> date_to_day("1190-02-00", end=True) - date_to_day("1190-02-00")
+    27
+
+    Args:
+        string (string): the date
+        end (bool): resolve unknown month or day to the end of the 
+            year or month, for the upper bound of a date range
+    Returns:
+        int or None if the string is not a date
+    """
+    try:
+        year, month, day = [int(x) for x in string.split("-")[:3]]
+        year = max(year, 1)
+        if month < 1:
+            month = 12 if end else 1
+            day = 0
+        month = min(month, 12)
+        if day < 1:
+            day = calendar.monthrange(year, month)[1] if end else 1
+        return datetime.date(year, month, 1).toordinal() + min(day, 31) - 1
+    except (ValueError, AttributeError):
+        return None
+
+
+def regest_days(regest):
+    """Returns (first day, last day) of a regest's date as day numbers
+    (see date_to_day) or None if the date is unknown. Unknown months or
+    days span the whole year or month.
+
+    >>> days = regest_days({"date": ["1190-00-00", "1190-00-00"]})
+    >>> days[1] - days[0]
+    364
+    """
+
+    dates = regest.get("date") or []
+    first = [date_to_day(d) for d in dates]
+    last = [date_to_day(d, end=True) for d in dates]
+    first = [d for d in first if d is not None]
+    last = [d for d in last if d is not None]
+    if not first:
+        return None
+    return min(first), max(last)
+
+
 def extract_otherpersons(et, string="zeugen"):
     l=[]
     for ch in yield_divs(et):
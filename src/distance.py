@@ -1,107 +1,332 @@
+import abc
 import json
-from geopy.distance import vincenty
+import logging
 import Levenshtein
 import geohelpers as gh
+import geodesic
 import math
 import numpy as np
+from utils import LRUCache
 
 
-def cost0(x, y):
-    """simplest cost fo traveling from p=x to p'=y
+def vincenty_km(x, y):
+    """vincenty distance in km between two (lat, lng) points"""
 
-    Args:
-        x (list): list representing p with [lat, lng, ...]
-        y (list): list representing p' with [lat, lng, ...]
-   
-    Returns:
-        float: vincenty distance       
-        float: vincenty distance
+    return geodesic.point_distance(float(x[0]), float(x[1]), float(y[0]), float(y[1]))
+
+
+class CostFunction(abc.ABC):
+    """Cost of traveling from places p=x to places p'=y
+
+    A cost function computes whole cost matrices from arrays of features,
+    rows of x and y are [lat, lng, LevR, population count, avg. distance
+    to helper places] (see QueryObject.cost_matrix). Implementations
+    must override matrix (subclasses without it cannot be instantiated), 
+    the scalar version (called like the former cost functions with two 
+    feature lists) then comes for free.
+
+    Attributes:
+        monotone (bool): True if the costs are non-decreasing in the
+            distance, which allows exact pruning of transitions with a
+            lower bound of the distances (see QueryObject._pruned_costs)
     """
-    di = vincenty(( x[0],x[1]),(y[0],y[1])).km#/div
-    return di, di
 
+    monotone = True
+
+    @abc.abstractmethod
+    def matrix(self, x, y, vd):
+        """costs for all pairs of places at once
+
+        Args:
+            x (np.array): shape (n, 5), features of places p
+            y (np.array): shape (m, 5), features of places p'
+            vd (np.array): shape (n, m), vincenty distances
+        Returns:
+            np.array: shape (n, m), traveling costs
+        """
+
+    def __call__(self, x, y, vd=None):
+        """cost of traveling from p=x to p'=y
+
+        Args:
+            x (list): list representing p with [lat, lng, ...]
+            y (list): list representing p' with [lat, lng, ...]
+            vd: in case we have vincenty distance pre computed
+        Returns:
+            float: traveling cost
+            float: vincenty distance
+        """
+        if not vd:
+            vd = vincenty_km(x, y)
+        c = self.matrix(np.array([x], dtype=float), np.array([y], dtype=float)
+                , np.array([[vd]], dtype=float))
+        return float(c[0, 0]), vd
+
+
+class Cost0(CostFunction):
+    """simplest cost: the vincenty distance"""
+
+    def __call__(self, x, y, vd=None):
+        if not vd:
+            vd = vincenty_km(x, y)
+        return vd, vd
+
+    def matrix(self, x, y, vd):
+        return vd
+
+
+class Cost1(CostFunction):
 
-def cost1(x, y, vd=None, coef = [None, None, 1, 1, 0.25]):
-    """advanced cost to traveling from p=x to p'=y
+    def __init__(self, coef=[None, None, 1, 1, 0.25]):
+        """advanced cost: distance plus weighted distance to helper 
+        places of p', divided by a bonus for similar names and large 
+        population of p'
+
+        Args:
+            coef (list): weights for y, i.e., of LevR from name of p' 
+                found in data base to actual name of p' (index 2),
+                log of population count (3) and avg. distance to 
+                helper places of p' (4)
+        """
+        self.coef = coef
+        return None
+
+    def __call__(self, x, y, vd=None):
+        levr = y[2] 
+        pop = y[3] 
+        avg_helper_dist = y[4]
+        
+        levr_coef = self.coef[2] 
+        pop_coef = self.coef[3] 
+        avg_helper_dist_coef = self.coef[4]
+        
+        if not vd:
+            vd = vincenty_km(x, y)
+        
+        numer = vd + avg_helper_dist_coef * avg_helper_dist
+        
+        denom = 1 + levr_coef * levr 
+        denom += pop_coef*math.log(pop, 1000)
+        
+        return numer/denom, vd
+
+    def matrix(self, x, y, vd):
+        #element-wise the same arithmetic as __call__
+        levr_coef = self.coef[2] 
+        pop_coef = self.coef[3] 
+        avg_helper_dist_coef = self.coef[4]
+
+        numer = vd + avg_helper_dist_coef * y[:, 4]
+
+        denom = 1 + levr_coef * y[:, 2]
+        #math.log, not np.log, to get exactly the values of __call__
+        denom += pop_coef * np.array([math.log(pop, 1000) for pop in y[:, 3].tolist()])
+
+        return numer / denom
+
+
+class ScalarCost(CostFunction):
+
+    #nothing is known about a plain function
+    monotone = False
+
+    def __init__(self, fun):
+        """Wraps a plain cost function fun(x, y, vd=None) ---> (cost, vd),
+        the cost matrix is computed pair by pair
+
+        Args:
+            fun (function): cost of traveling from one place to another,
+                called with feature lists like CostFunction.__call__
+        """
+        self.fun = fun
+        return None
+
+    def __call__(self, x, y, vd=None):
+        return self.fun(x, y, vd=vd)
+
+    def matrix(self, x, y, vd):
+        costs = np.full(vd.shape, np.inf)
+        xs, ys = x.tolist(), y.tolist()
+        for k, j in zip(*np.nonzero(np.isfinite(vd))):
+            costs[k, j] = self.fun(xs[k], ys[j], vd=float(vd[k, j]))[0]
+        return costs
+
+
+def as_cost_function(costfun):
+    """returns costfun as CostFunction, plain functions are wrapped"""
+
+    if isinstance(costfun, CostFunction):
+        return costfun
+    return ScalarCost(costfun)
+
+
+cost0 = Cost0()
+cost1 = Cost1()
+
+
+def maybe_population(geodata, pid):
+    """returns the population count for a place id, 1 if unknown"""
+
+    pop = float(geodata[pid]["population"])
+
+    if not pop:
+        return 1
+    else:
+        return int(pop)
+
+
+def max_name_ratio(geodata, pn, pid):
+    """returns the maximum Levenshtein ratio between a place name and the
+    (alternate) names of a place id"""
+
+    names = geodata[pid]["alternatenames"] + [geodata[pid]["name"]]
+    
+    lrs = [ Levenshtein.ratio(pn, x) for x in names]
+
+    return max(lrs)
+
+
+def place_features(geodata, pn, pid):
+    """ Maps a place name and a place name id onto a feature vector
 
     Args:
-        x (list): list representing p with [lat, lng, ...]
-        y (list): list representing p' with [lat
-            , lng
-            , LevR from name of p' found in data base to actual name of p'
-            , population count
-            , avg. distance to helper places of p']
-        vd: in case we have vincenty distance pre computed
-        coef (list): weights for y
+        geodata (dict): geonames id ---> dict with "name", "alternatenames"
+            "latitude", "longitude" and "population"
+        pn (string): place name
+        pid (string): place name id (geonamesid)
     Returns:
-        float: traveling cost
-        float: vincenty distance
+        a vector [y, x, maxlr, pop] that describes a place
     """
+        
+    #levenshtein distance
+    maxlr = max_name_ratio(geodata, pn, pid)
 
-    levr = y[2] 
-    pop = y[3] 
-    avg_helper_dist = y[4]
-    
-    levr_coef = coef[2] 
-    pop_coef = coef[3] 
-    avg_helper_dist_coef = coef[4]
+    #actual geopoint
+    y,x = geodata[pid]["latitude"], geodata[pid]["longitude"]
     
-    if not vd:
-        vd = vincenty( (x[0], x[1]),(y[0], y[1]) ).km
+    #population
+    pop = maybe_population(geodata, pid)
     
-    numer = vd + avg_helper_dist_coef * avg_helper_dist
-    
-    denom = 1 + levr_coef * levr 
-    denom += pop_coef*math.log(pop, 1000)
-    
-    return numer/denom, vd
+    feavec = [y, x, maxlr, pop]
+    feavec = [float(x) for x in feavec]
+    return feavec
+
+
+def pair_key(placeid1, placeid2):
+    """key of an unordered pair of geonames ids in the distance cache"""
+
+    a, b = int(placeid1), int(placeid2)
+    return (a, b) if a < b else (b, a)
+
+
+def _entry_nbytes(entry):
+    """size of an entry (ids, distance matrix) of the transition cache"""
+
+    return entry[1].nbytes
 
 
 class QueryObject:
 
     def __init__(self, geodata, costfun=cost0
-            , save_feas=True, save_dists=False):
+            , save_feas=True, save_dists=False, distance_method="vincenty"
+            , transition_cache_mb=512, features=None
+            , feature_cache_size=1000000, distance_cache_size=1000000
+            , distances=None):
         """ Inits object for distance/cost queries
 
         Args:
             geodata (dict): a dictionary that maps geonames indices to
                 dictionaries that allow us to grab "latitude" "longitude"
                 and "polulation" count
-            costfun (placefeatures x placefeatures -> cost): 
-                a function that calculates the cost between two places. can also
-                incorporate other features such as population count.
+            costfun (CostFunction): calculates the cost between places, 
+                e.g. cost0, cost1 or Cost1(coef=...). can also incorporate 
+                other features such as population count. A plain function 
+                (placefeatures x placefeatures -> cost) is wrapped with 
+                ScalarCost.
             save_feas (bool): use memory to store calcluated place features
-            save_dist (bool): use memory to store cost calculations. 
-                Not recommended atm, blows up memory.
-            ii (dict)
-
+            save_dist (bool): use memory to store distances between places
+                computed by cost
+            distance_method (string): vincenty, haversine or karney,
+                see geodesic.py
+            transition_cache_mb (float): memory (MB) for distance matrices
+                between the candidates of two place names that are kept
+                for cost_matrix (least recently used are dropped), 0: none
+            features (FeatureTable): precomputed feature vectors of the
+                candidates, see featuretable.py, vectors of pairs that
+                are missing in the table are computed on the fly
+            feature_cache_size (int): maximum number of feature vectors
+                stored if save_feas (least recently used are dropped)
+            distance_cache_size (int): maximum number of distances
+                stored if save_dists (least recently used are dropped)
+            distances (DistanceStore): precomputed distances between
+                frequent candidates, see distancestore.py, consulted
+                before distances are computed
         """
         self.geodata = geodata
-        self._cost = costfun
-        self.saver= {}
+        self._cost = as_cost_function(costfun)
         self.save_feas = save_feas
         self.save_dists = save_dists
+        self.feature_saver = LRUCache(feature_cache_size if save_feas else 0)
+        self.distance_saver = LRUCache(distance_cache_size if save_dists else 0)
+        self.distance_method = distance_method
+        self.transitions = LRUCache(int(transition_cache_mb * 2**20)
+                , weight=_entry_nbytes)
+        self.features = features
+        self.distances = distances
+        #average distances to the helper places of the current station
+        self._helper_key = None
+        self._helper_avgs = {}
         return None
 
     def _vd(self, x, y):
-        return cost0(x,y)[0]
+        return geodesic.point_distance(float(x[0]), float(x[1])
+            , float(y[0]), float(y[1]), method=self.distance_method)
     
     def _vd_by_idx(self,idx,idxother):
         if not idx or not idxother:
             return 0.0
-        y,x = self.geodata[idx]["latitude"], self.geodata[idx]["longitude"]
-        ybar,xbar = self.geodata[idxother]["latitude"] ,self.geodata[idxother]["longitude"]
-        return cost0( [y,x], [ybar, xbar])[0]
+        return self._vd(self._point(idx), self._point(idxother))
+
+    def _point(self, pid):
+        """returns latitude and longitude of a place id"""
+
+        return float(self.geodata[pid]["latitude"]), float(self.geodata[pid]["longitude"])
+
+    def _coordinates(self, pids):
+        """returns two arrays with latitudes and longitudes of place ids"""
+
+        lat = np.array([float(self.geodata[pid]["latitude"]) for pid in pids])
+        lng = np.array([float(self.geodata[pid]["longitude"]) for pid in pids])
+        return lat, lng
+
+    def distances_to_many(self, pid, pids):
+        """distances from many place ids to one place id (one call)
+
+        Returns:
+            np.array with len(pids) distances
+        """
+        if not pid or not len(pids):
+            return np.zeros(len(pids))
+        lat, lng = self._coordinates([pid])
+        lats, lngs = self._coordinates(pids)
+        return geodesic.distance(lats, lngs, lat[0], lng[0]
+                , method=self.distance_method)
+
+    def distance_block(self, pids1, pids2):
+        """distances from every place id in pids1 to every place id in
+        pids2, computed in one call
+
+        Returns:
+            np.array with shape (len(pids1), len(pids2))
+        """
+        lat1, lng1 = self._coordinates(pids1)
+        lat2, lng2 = self._coordinates(pids2)
+        return geodesic.pairwise(lat1, lng1, lat2, lng2, method=self.distance_method)
     
     def _maybe_population(self, pid):
         """returns the population count for a place id"""
 
-        pop = float(self.geodata[pid]["population"])
-
-        if not pop:
-            return 1
-        else:
-            return int(pop)
+        return maybe_population(self.geodata, pid)
 
     def _compute_feavec(self, pn, pid):
         """ Maps a place name and a place name id onto a feature vector
@@ -112,23 +337,7 @@ class QueryObject:
         Returns:
             a vector [y, x, maxlr, pop] that describes a place
         """
-            
-        #levenshtein distance
-        names = self.geodata[pid]["alternatenames"] + [self.geodata[pid]["name"]]
-        
-        lrs = [ Levenshtein.ratio(pn, x) for x in names]
-
-        maxlr = max(lrs)
-
-        #actual geopoint
-        y,x = self.geodata[pid]["latitude"], self.geodata[pid]["longitude"]
-        
-        #population
-        pop = self._maybe_population(pid)
-        
-        feavec = [y, x, maxlr, pop]
-        feavec = [float(x) for x in feavec]
-        return feavec
+        return place_features(self.geodata, pn, pid)
 
     def _maybe_inform_with_helper_places(self, placeid, feavec, helper_places=[]):
         """given a place id and its feature vector, return 
@@ -148,12 +357,13 @@ class QueryObject:
         avg_dist = []
         
         for hp in helper_places:
-            combi_key = "#".join(list(sorted([placeid,hp])))
-            if self.save_dists and combi_key in self.saver:
-                vd = self.saver[combi_key]
-            else:
-                ybar,xbar = self.geodata[hp]["latitude"], self.geodata[hp]["longitude"]
-                vd = self._vd( (y, x), (ybar, xbar) )
+            vd = None
+            if self.save_dists:
+                vd = self.distance_saver.get(pair_key(placeid, hp))
+            if vd is None and self.distances is not None:
+                vd = self.distances.distance(placeid, hp)
+            if vd is None:
+                vd = self._vd( (y, x), self._point(hp) )
             avg_dist.append(vd)
         
         if sum(avg_dist+[0.0]) > 0.01:
@@ -161,6 +371,234 @@ class QueryObject:
         else:
             return 0.0
 
+    def _feavec(self, pn, pid):
+        """feature vector of a place, memorized in feature_saver"""
+
+        if self.features is not None:
+            feavec = self.features.feature_vector(pn, pid)
+            if feavec is not None:
+                return feavec
+        key = (pn, int(pid))
+        feavec = self.feature_saver.get(key)
+        if feavec is not None:
+            return feavec
+        feavec = self._compute_feavec(pn, pid)
+        self.feature_saver.put(key, feavec)
+        return feavec
+
+    def feature_matrix(self, pn, pids):
+        """feature vectors of many place ids for a place name
+
+        Returns:
+            np.array with shape (len(pids), 4), rows [y, x, maxlr, pop]
+        """
+        if self.features is not None:
+            feas = self.features.feature_matrix(pn, pids)
+            if feas is not None:
+                return feas
+        return np.array([self._feavec(pn, pid) for pid in pids]).reshape(-1, 4)
+
+    def _helper_avgs_for(self, helper_places):
+        """returns the cache place id ---> average distance to helper places,
+        emptied when the helper places change (i.e., with every station)"""
+
+        key = tuple(helper_places)
+        if key != self._helper_key:
+            self._helper_key = key
+            self._helper_avgs = {}
+        return self._helper_avgs
+
+    def helper_distance(self, placeid, feavec, helper_places=[]):
+        """cached version of _maybe_inform_with_helper_places
+
+        Every candidate of a station is compared with the same helper
+        places in every transition, so the average is computed once per
+        candidate and helper places.
+
+        Args:
+            placeid (string): place id geonames
+            feavec (list): vector that represents the place
+            helper_places (list): list with geonames ids of possible places in vicinity
+        Returns:
+            A float that represents the average distance to helper places
+        """
+        if not helper_places:
+            return 0.0
+        avgs = self._helper_avgs_for(helper_places)
+        avg = avgs.get(placeid)
+        if avg is None:
+            avg = self._maybe_inform_with_helper_places(placeid, feavec, helper_places)
+            avgs[placeid] = avg
+        return avg
+
+    def helper_distances(self, pids, feas, helper_places=[]):
+        """helper_distance for many place ids at once
+
+        Args:
+            pids (list): geonames ids
+            feas (np.array): their feature vectors, see feature_matrix
+            helper_places (list): list with geonames ids of possible places in vicinity
+        Returns:
+            np.array with len(pids) average distances to helper places
+        """
+        if not helper_places:
+            return np.zeros(len(pids))
+        avgs = self._helper_avgs_for(helper_places)
+        todo = [i for i, pid in enumerate(pids) if pid not in avgs]
+        if todo and self.save_dists:
+            for i in todo:
+                avgs[pids[i]] = self._maybe_inform_with_helper_places(pids[i]
+                        , list(feas[i]), helper_places)
+        elif todo:
+            dists = self._stored_block([pids[i] for i in todo], helper_places)
+            if dists is None:
+                lat, lng = self._coordinates(helper_places)
+                dists = geodesic.pairwise(feas[todo, 0], feas[todo, 1], lat, lng
+                        , method=self.distance_method)
+            computed = np.where(dists.sum(1) > 0.01, dists.mean(1), 0.0)
+            for i, avg in zip(todo, computed.tolist()):
+                avgs[pids[i]] = avg
+        return np.array([avgs[pid] for pid in pids])
+
+    def cost_matrix(self, placename1, placeids1, placename2, placeids2, helper_places=[]
+            , rows=None, cum_dist=None, max_distance=None):
+        """compute costs of traveling from every place id in placeids1 to
+        every place id in placeids2
+
+        Same values as cost, but with one distance computation for the
+        whole block and one call of the matrix of the cost function.
+
+        Args:
+            placename1 (string): name of the first place
+            placeids1 (list): geonames ids of the first place
+            placename2 (string): name of the 2nd place
+            placeids2 (list): geonames ids of the 2nd place
+            helper_places (list): list with geonames ids 
+                                  of possible places in vicinity of the next place
+            rows (np.array): if given, only costs from these indices of 
+                placeids1 are computed
+            cum_dist (np.array): if given, cumulative costs of (the rows of) 
+                placeids1. Only costs that may give a minimum of 
+                cum_dist[k] + cost[k, j] over k are computed, the others are 
+                set to inf (exact pruning with a lower bound of the distances,
+                see _pruned_costs)
+            max_distance (float): if given, costs of pairs that are further
+                apart than this (km) are inf. Distances of pairs that are
+                certainly further apart are not computed
+        Returns:
+            np.array with shape (len(placeids1), len(placeids2)), 
+            (len(rows), len(placeids2)) if rows are given
+        """
+
+        costfun = self._cost.matrix
+        if not self._cost.monotone:
+            cum_dist = None
+        feas1 = self.feature_matrix(placename1, placeids1)
+        feas2 = self.feature_matrix(placename2, placeids2)
+        prune = (cum_dist is not None or max_distance is not None) \
+                and not self._has_transition(placename1, placeids1, placename2, placeids2) \
+                and not self._is_stored(placeids1, placeids2) \
+                and len(rows if rows is not None else placeids1) * len(placeids2) \
+                > geodesic.SMALL_BLOCK
+        if not prune:
+            vd = self._transition_distances(placename1, placeids1, feas1
+                    , placename2, placeids2, feas2, rows=rows)
+            if max_distance is not None:
+                vd = np.where(vd > max_distance, np.inf, vd)
+        if rows is not None:
+            placeids1 = [placeids1[k] for k in rows]
+            feas1 = feas1[rows]
+        mh1 = self.helper_distances(placeids1, feas1, helper_places)
+        mh2 = self.helper_distances(placeids2, feas2, helper_places)
+        x = np.column_stack([feas1, mh1])
+        y = np.column_stack([feas2, mh2])
+        if prune:
+            return self._pruned_costs(costfun, x, y, cum_dist, max_distance)
+        return costfun(x, y, vd)
+
+    def _pruned_costs(self, costfun, x, y, cum_dist=None, max_distance=None):
+        """cost matrix where only costs that may give the minimum of
+        cum_dist[k] + cost[k, j] for some j and whose distance does not
+        exceed max_distance are computed, others are inf
+
+        The costs with a lower bound of the distances (geodesic.lower_bound)
+        bound the total costs from below. The pair with lowest bound is
+        computed for every j, which gives an upper bound of the minimum,
+        then all pairs whose lower bound does not exceed it. Pairs with
+        a higher lower bound cannot be the minimum (or a tie of it).
+        """
+        bound = geodesic.lower_bound(x[:, 0][:, None], y[:, 0][None, :])
+        todo = np.ones(bound.shape, dtype=bool)
+        if max_distance is not None:
+            todo = bound <= max_distance
+        vd = np.full(bound.shape, np.inf)
+        done = 0
+        if cum_dist is not None:
+            lower = np.asarray(cum_dist)[:, None] + costfun(x, y, bound)
+            lower[~todo] = np.inf
+            best = lower.argmin(0)
+            cols = np.flatnonzero(np.isfinite(lower[best, np.arange(len(best))]))
+            vd[best[cols], cols] = geodesic.paired(x[best[cols], 0], x[best[cols], 1]
+                    , y[cols, 0], y[cols, 1], method=self.distance_method)
+            todo[best[cols], cols] = False
+            done = len(cols)
+            if max_distance is not None:
+                vd[vd > max_distance] = np.inf
+            upper = (np.asarray(cum_dist)[:, None] + costfun(x, y, vd)).min(0)
+            todo &= lower <= upper[None, :]
+        k, j = np.nonzero(todo)
+        vd[k, j] = geodesic.paired(x[k, 0], x[k, 1], y[j, 0], y[j, 1]
+                , method=self.distance_method)
+        if max_distance is not None:
+            vd[vd > max_distance] = np.inf
+        logging.debug("pruning: {}/{} distances computed".format(
+            len(k) + done, vd.size))
+        return costfun(x, y, vd)
+
+    def _has_transition(self, placename1, placeids1, placename2, placeids2):
+        """True if the distance matrix is in the transition cache"""
+
+        cached = self.transitions.data.get((placename1, placename2))
+        return cached is not None and cached[0] == (tuple(placeids1), tuple(placeids2))
+
+    def _is_stored(self, placeids1, placeids2):
+        """True if all distances are in the distance store"""
+
+        return self.distances is not None \
+                and self.distances.rows(placeids1) is not None \
+                and self.distances.rows(placeids2) is not None
+
+    def _stored_block(self, placeids1, placeids2):
+        """distance matrix from the distance store, None if not stored"""
+
+        if self.distances is None:
+            return None
+        return self.distances.block(placeids1, placeids2)
+
+    def _transition_distances(self, placename1, placeids1, feas1
+            , placename2, placeids2, feas2, rows=None):
+        """distance matrix between the candidates of two place names,
+        looked up in the transition cache if the candidates are the same.
+        Matrices for a subset of rows are computed, but not cached."""
+
+        key = (placename1, placename2)
+        cached = self.transitions.get(key)
+        ids = (tuple(placeids1), tuple(placeids2))
+        if cached is not None and cached[0] == ids:
+            return cached[1] if rows is None else cached[1][rows]
+        if rows is not None:
+            feas1 = feas1[rows]
+            vd = self._stored_block([placeids1[k] for k in rows], placeids2)
+        else:
+            vd = self._stored_block(placeids1, placeids2)
+        if vd is None:
+            vd = geodesic.pairwise(feas1[:, 0], feas1[:, 1], feas2[:, 0], feas2[:, 1]
+                    , method=self.distance_method)
+        if rows is None:
+            vd.setflags(write=False)
+            self.transitions.put(key, (ids, vd))
+        return vd
+
     def cost(self, placename1, placeid1, placename2, placeid2, helper_places=[]):
         """compute cost of traveling from a place to the other
 
@@ -178,36 +616,130 @@ class QueryObject:
         if not any([placename1, placeid1, placename2]):
             return self._maybe_inform_with_helper_places(placeid2, feavec2, helper_places)
                 
-        key1 = placename1+ placeid1
-        key2 =  placename2 + placeid2
-        combi_key = "#".join(list(sorted([placeid1,placeid2])))
         vd = None
-        if self.save_dists and combi_key in self.saver:
-            vd = self.saver[combi_key]
+        if self.save_dists:
+            key = pair_key(placeid1, placeid2)
+            vd = self.distance_saver.get(key)
         
+        feavec1 = self._feavec(placename1, placeid1)
+        feavec2 = self._feavec(placename2, placeid2)
         
-        if self.save_feas and key1 in self.saver:
-            feavec1 = self.saver[key1]
-        else:
-            feavec1 = self._compute_feavec(placename1, placeid1)
-            self.saver[key1] = feavec1
-
-        if self.save_feas and key2 in self.saver:
-            feavec2 = self.saver[key2]
-        else:
-            feavec2 = self._compute_feavec(placename2, placeid2)
-            self.saver[key2] = feavec2
-        
-        mh1 = self._maybe_inform_with_helper_places(placeid1, feavec1, helper_places)
-        mh2 = self._maybe_inform_with_helper_places(placeid2, feavec2, helper_places)
+        mh1 = self.helper_distance(placeid1, feavec1, helper_places)
+        mh2 = self.helper_distance(placeid2, feavec2, helper_places)
         
         feavec1bar = feavec1+[mh1]        
         feavec2bar = feavec2+[mh2]
+        if vd is None and self.distances is not None:
+            vd = self.distances.distance(placeid1, placeid2)
+        if vd is None:
+            vd = self._vd(feavec1, feavec2)
         c, vdis = self._cost(feavec1bar, feavec2bar, vd=vd)
-        if not vd and self.save_dists:
-            self.saver[combi_key] = vdis
+        if self.save_dists and key not in self.distance_saver:
+            self.distance_saver.put(key, vdis)
         return c
 
+class IndexedQueryObject(QueryObject):
+
+    def __init__(self, geodata, C, **kwargs):
+        """QueryObject over dense arrays of the candidates of C
+
+        The geonames ids of all candidates are translated once to int32
+        rows into float64 arrays with latitude, longitude and population,
+        and the candidate list of every name to an array of rows. The
+        feature matrix of the candidates of a name (cost_matrix, i.e., 
+        every step of search) is then gathered from the arrays with the
+        rows of the name, the name similarities (maxlr) are computed (or
+        taken from the feature table) once per name. Single place ids 
+        (cost, text solvers) are looked up with one dict access instead 
+        of parsing the strings of geodata. Costs are the same as with 
+        QueryObject. Place ids that are not candidates (e.g. helper places 
+        outside of C) and candidate lists that differ from C are handled 
+        as in QueryObject.
+
+        Args:
+            geodata (dict): see QueryObject
+            C (dict): place name ---> list with candidate geonameids
+            kwargs: see QueryObject
+        """
+        QueryObject.__init__(self, geodata, **kwargs)
+        pids = sorted(set(pid for candidates in C.values() for pid in candidates))
+        self.pid_rows = {pid: row for row, pid in enumerate(pids)}
+        self.pids = pids
+        self.latitude = np.array([float(geodata[pid]["latitude"]) for pid in pids])
+        self.longitude = np.array([float(geodata[pid]["longitude"]) for pid in pids])
+        self.population = np.array([float(maybe_population(geodata, pid)) 
+            for pid in pids])
+        self.candidates = C
+        self.candidate_rows = {name: self.rows(candidates) for name, candidates in C.items()}
+        self._name_ratios = {}
+        return None
+
+    def _name_rows(self, pn, pids):
+        """rows of the candidates of pn if pids are the candidates of pn
+        in C, None otherwise"""
+
+        candidates = self.candidates.get(pn)
+        if candidates is None or not (pids is candidates or pids == candidates):
+            return None
+        return self.candidate_rows[pn]
+
+    def _ratios(self, pn):
+        """maxlr of all candidates of pn in C, computed once"""
+
+        ratios = self._name_ratios.get(pn)
+        if ratios is None:
+            feas = None
+            if self.features is not None:
+                feas = self.features.feature_matrix(pn, self.candidates[pn])
+            if feas is not None:
+                ratios = feas[:, 2].copy()
+            else:
+                ratios = np.array([max_name_ratio(self.geodata, pn, pid) 
+                    for pid in self.candidates[pn]], dtype=float)
+            self._name_ratios[pn] = ratios
+        return ratios
+
+    def feature_matrix(self, pn, pids):
+        rows = self._name_rows(pn, pids)
+        if rows is None:
+            return QueryObject.feature_matrix(self, pn, pids)
+        return np.column_stack([self.latitude[rows], self.longitude[rows]
+            , self._ratios(pn), self.population[rows]])
+
+    def rows(self, pids):
+        """returns the rows of place ids as int32 array, -1 for place ids
+        that are not candidates"""
+
+        return np.array([self.pid_rows.get(pid, -1) for pid in pids], dtype=np.int32)
+
+    def _point(self, pid):
+        row = self.pid_rows.get(pid)
+        if row is None:
+            return QueryObject._point(self, pid)
+        return float(self.latitude[row]), float(self.longitude[row])
+
+    def _coordinates(self, pids):
+        rows = self.rows(pids)
+        if np.any(rows < 0):
+            return QueryObject._coordinates(self, pids)
+        return self.latitude[rows], self.longitude[rows]
+
+    def _maybe_population(self, pid):
+        row = self.pid_rows.get(pid)
+        if row is None:
+            return QueryObject._maybe_population(self, pid)
+        return int(self.population[row])
+
+    def _compute_feavec(self, pn, pid):
+        row = self.pid_rows.get(pid)
+        if row is None:
+            return QueryObject._compute_feavec(self, pn, pid)
+        return [float(self.latitude[row])
+                , float(self.longitude[row])
+                , float(max_name_ratio(self.geodata, pn, pid))
+                , float(self.population[row])]
+
+
 def get_center(idxs, geodat):
     """Returns the center of several places (avg. of lat and lng)"""
 
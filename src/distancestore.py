@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+import logging
+from collections import Counter
+import numpy as np
+import geodesic
+
+
+class DistanceStore:
+
+    def __init__(self, path):
+        """Read-only, memory-mapped matrix of distances between places
+
+        The store holds the distances (km, float32) between all pairs of a
+        fixed set of geonameids, e.g. the candidates of the most frequent
+        place names, see build and open_distance_store. Rows and columns
+        follow the sorted ids. Worker processes re-open the memory map, so
+        they share the matrix through the page cache. float32 keeps about
+        7 significant digits, so costs from stored distances differ from
+        computed ones by up to ~1e-6 relative (e.g. a few mm per 1000 km).
+
+        Args:
+            path (string): directory written by DistanceStore.build
+        """
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.ids = np.asarray(np.load(os.path.join(path, "ids.npy"), mmap_mode="r"))
+        if len(self.ids):
+            self.matrix = np.asarray(np.memmap(os.path.join(path, "distances.f32")
+                , dtype=np.float32, mode="r", shape=(len(self.ids), len(self.ids))))
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        return None
+
+    def __reduce__(self):
+        return (DistanceStore, (self.path,))
+
+    @classmethod
+    def build(cls, path, pids, geodata, method="vincenty", key="", block_size=256):
+        """computes the distances between all pairs of pids block by
+        block of rows and writes them to the directory path
+
+        Args:
+            path (string): directory of the store
+            pids (list): geonameids
+            geodata (dict): geonames data, see distance.QueryObject
+            method (string): see geodesic.py
+            key (string): id of the inputs, see store_key
+            block_size (int): number of rows computed at once
+        Returns:
+            DistanceStore
+        """
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        ids = np.array(sorted(set(int(pid) for pid in pids)), dtype=np.int64)
+        np.save(os.path.join(path, "ids.npy"), ids)
+        n = len(ids)
+        lat = np.array([float(geodata[str(pid)]["latitude"]) for pid in ids])
+        lng = np.array([float(geodata[str(pid)]["longitude"]) for pid in ids])
+        if n:
+            matrix = np.memmap(os.path.join(path, "distances.f32")
+                    , dtype=np.float32, mode="w+", shape=(n, n))
+            for start in range(0, n, block_size):
+                end = min(start + block_size, n)
+                matrix[start:end] = geodesic.pairwise(lat[start:end], lng[start:end]
+                        , lat, lng, method=method)
+                logging.info("distance store: {}/{} rows".format(end, n))
+            matrix.flush()
+            del matrix
+        with open(meta_path, "w") as f:
+            f.write(json.dumps({"key": key, "method": method, "size": n}, indent=4))
+        return cls(path)
+
+    def rows(self, pids):
+        """returns the rows of geonameids, None if one of them is not stored"""
+
+        if not len(self.ids):
+            return None
+        query = np.array([int(pid) for pid in pids], dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.ids, query), len(self.ids) - 1)
+        if not np.all(self.ids[rows] == query):
+            return None
+        return rows
+
+    def block(self, pids1, pids2):
+        """returns the distance matrix between pids1 and pids2 (float64),
+        None if one of them is not stored"""
+
+        rows1 = self.rows(pids1)
+        if rows1 is None:
+            return None
+        rows2 = self.rows(pids2)
+        if rows2 is None:
+            return None
+        return self.matrix[np.ix_(rows1, rows2)].astype(np.float64)
+
+    def distance(self, pid1, pid2):
+        """returns the distance between two geonameids, None if one of
+        them is not stored"""
+
+        rows = self.rows([pid1, pid2])
+        if rows is None:
+            return None
+        return float(self.matrix[rows[0], rows[1]])
+
+
+def frequent_candidates(C, names, max_places=10000):
+    """Collects the candidates of the most frequent place names
+
+    Args:
+        C (dict): place name ---> list with candidate geonameids
+        names (list): place names of all stations and texts (with repeats)
+        max_places (int): stop before the candidates exceed this number
+    Returns:
+        sorted list with geonameids
+    """
+    pids = set()
+    for name, _ in sorted(Counter(n for n in names if n in C).items()
+            , key=lambda x: (-x[1], x[0])):
+        more = pids.union(C[name])
+        if len(more) > max_places:
+            break
+        pids = more
+    return sorted(pids)
+
+
+def store_key(pids, method="vincenty", snapshot=""):
+    """Returns a hash of the stored places, the distance method and the
+    geonames snapshot"""
+
+    h = hashlib.sha1(json.dumps([method, snapshot]).encode("utf8"))
+    h.update(",".join(sorted(pids)).encode("utf8"))
+    return h.hexdigest()
+
+
+def open_distance_store(path, C, names, geodata, max_places=10000
+        , method="vincenty", snapshot=""):
+    """Opens the distance store in path if it holds the candidates of the
+    most frequent names of this run, otherwise builds it
+
+    Args:
+        path (string): directory of the store
+        C (dict): place name ---> list with candidate geonameids
+        names (list): place names of all stations and texts (with repeats)
+        geodata (dict): geonames data, see distance.QueryObject
+        max_places (int): maximum number of stored places, the matrix
+            needs 4 * max_places ** 2 bytes on disk
+        method (string): see geodesic.py
+        snapshot (string): id of the geonames snapshot,
+            see geohelpers.geo_names_snapshot
+    Returns:
+        DistanceStore
+    """
+    pids = frequent_candidates(C, names, max_places=max_places)
+    key = store_key(pids, method=method, snapshot=snapshot)
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            if json.load(f).get("key") == key:
+                logging.info("loaded distance store from {}".format(path))
+                return DistanceStore(path)
+    logging.info("computing distances between {} places...".format(len(pids)))
+    return DistanceStore.build(path, pids, geodata, method=method, key=key)
@@ -1,6 +1,6 @@
 import numpy as np
 import json
-from geopy.distance import vincenty
+from geodesic import vincenty
 import data_helpers as dh
 from sklearn.metrics import mean_squared_error
 from scipy.stats import pearsonr
@@ -88,7 +88,8 @@ def create_gold_uri_loc_mapping_by_geoname_id(ridict,manualdict):
     gold = {}
     man = manualdict
     import geohelpers as gh
-    geonames, _ = gh.read_geo_names()
+    geonames, _ = gh.read_geo_names(return_inverted_index=False
+            , cache_dir="../geodata/compiled/")
     for uri,elm in ridict.items():
         gold[uri] = {}
         e = elm["location"]
@@ -258,6 +259,15 @@ def get_data(pred_uri_loc_mapping
         return this, gold, years
 
 
+def km_deltas(this, gold):
+    """returns the km distances between the predicted and gold
+    coordinates, an empty list if there are none"""
+
+    if not this:
+        return []
+    return vincenty(*np.transpose(this), *np.transpose(gold)).tolist()
+
+
 def evaluate(pred_uri_loc_mapping, gold_uri_loc_mapping, level = "event"):
     
     this, gold, years = get_data(pred_uri_loc_mapping
@@ -265,7 +275,10 @@ def evaluate(pred_uri_loc_mapping, gold_uri_loc_mapping, level = "event"):
             , level=level
             , text_places=False)    
     
-    km_deltas_this = [vincenty(this[i],gold[i]).km for i in range(len(gold))]
+    if not this:
+        logging.warning("no predictions with gold coordinates, nothing to evaluate")
+        return None
+    km_deltas_this = km_deltas(this, gold)
     dates = [i for i in range(len(years)) if years[i]  > 700 and years[i] < 1525]
     print(list(sorted(list(set(years)))))
     if not level == "macro":
@@ -300,7 +313,7 @@ def evaluate(pred_uri_loc_mapping, gold_uri_loc_mapping, level = "event"):
                 , level=level
                 , text_places=False
                 , macrotimes = True)    
-        km_deltas_thist = [vincenty(thist[i],goldt[i]).km for i in range(len(goldt))]
+        km_deltas_thist = km_deltas(thist, goldt)
         datest = [i for i in range(len(yearst)) if yearst[i]  > 700 and yearst[i] < 1525]
         if args.times:
             datedict = {"century": [yearst[i] for i in datest]
@@ -378,7 +391,10 @@ def evaluate_text_places(pred_uri_loc_mapping, gold_uri_loc_mapping, level = "ev
             , gold_uri_loc_mapping
             , level=level
             , text_places=True)    
-    km_deltas_this = [vincenty(this[i],gold[i]).km for i in range(len(gold))]
+    if not this:
+        logging.warning("no predictions with gold coordinates, nothing to evaluate")
+        return None
+    km_deltas_this = km_deltas(this, gold)
     dates = [i for i in range(len(years)) if years[i]  > 700 and years[i] < 1525]
     
     
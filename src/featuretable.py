@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+from distance import place_features
+
+
+class FeatureTable:
+
+    def __init__(self, names, offsets, pids, features, key=""):
+        """Feature vectors of all candidates of all place names
+
+        The candidates of names[i] are pids[offsets[i]:offsets[i+1]], in the
+        order of C, their feature vectors [y, x, maxlr, pop] (see
+        distance.place_features) are the rows of features with the same
+        positions. Population enters cost1 as log(pop), which is computed
+        from the stored count to keep the costs unchanged.
+
+        Args:
+            names (np.array): place names
+            offsets (np.array): int64, len(names) + 1 row offsets
+            pids (np.array): geonameids of the candidates
+            features (np.array): float64, shape (len(pids), 4)
+            key (string): hash of the candidates and geonames snapshot
+                the table was built from, see table_key
+        """
+        self.names = names
+        self.offsets = offsets
+        self.pids = pids
+        self.features = features
+        self.key = key
+        self.name_pos = {name: i for i, name in enumerate(names.tolist())}
+        self._pid_pos = {}
+        return None
+
+    @classmethod
+    def build(cls, C, geodata, key=""):
+        """computes the feature vectors of every (name, candidate) in C"""
+
+        names = sorted(C)
+        offsets = np.concatenate([[0]
+            , np.cumsum([len(C[name]) for name in names], dtype=np.int64)]).astype(np.int64)
+        pids = [pid for name in names for pid in C[name]]
+        features = np.zeros((len(pids), 4))
+        row = 0
+        for i, name in enumerate(names):
+            for pid in C[name]:
+                features[row] = place_features(geodata, name, pid)
+                row += 1
+            if (i + 1) % 1000 == 0:
+                logging.info("feature table: {}/{} names".format(i+1, len(names)))
+        return cls(np.array(names, dtype=str), offsets
+                , np.array(pids, dtype=str), features, key=key)
+
+    def save(self, path):
+        """writes the table to a npz file, load with FeatureTable.load"""
+
+        with open(path, "wb") as f:
+            np.savez(f, names=self.names, offsets=self.offsets, pids=self.pids
+                    , features=self.features, key=np.array(self.key))
+        return None
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["names"], data["offsets"], data["pids"]
+                    , data["features"], key=str(data["key"]))
+
+    def _positions(self, pn):
+        """returns the dict geonameid ---> row of the candidates of pn"""
+
+        i = self.name_pos[pn]
+        if i not in self._pid_pos:
+            start, end = int(self.offsets[i]), int(self.offsets[i+1])
+            self._pid_pos[i] = {pid: start + j
+                    for j, pid in enumerate(self.pids[start:end].tolist())}
+        return self._pid_pos[i]
+
+    def feature_vector(self, pn, pid):
+        """returns the feature vector of candidate pid of pn as list,
+        None if it is not in the table"""
+
+        if pn not in self.name_pos:
+            return None
+        row = self._positions(pn).get(pid)
+        if row is None:
+            return None
+        return self.features[row].tolist()
+
+    def feature_matrix(self, pn, pids):
+        """returns the feature vectors of candidates pids of pn as rows of
+        an array, None if one of them is not in the table"""
+
+        if pn not in self.name_pos:
+            return None
+        positions = self._positions(pn)
+        rows = [positions.get(pid) for pid in pids]
+        if None in rows:
+            return None
+        return self.features[rows]
+
+
+def table_key(C, snapshot=""):
+    """Returns a hash of the candidates and the geonames snapshot, a stored
+    table is only used for exactly these inputs"""
+
+    h = hashlib.sha1(snapshot.encode("utf8"))
+    h.update(json.dumps(C, sort_keys=True).encode("utf8"))
+    return h.hexdigest()
+
+
+def table_path(candidate_path):
+    """path of the feature table that belongs to a candidates file"""
+
+    return os.path.splitext(candidate_path)[0] + ".features.npz"
+
+
+def open_feature_table(path, C, geodata, snapshot=""):
+    """Loads the feature table stored at path if it was built from C,
+    otherwise builds it and stores it at path
+
+    Args:
+        path (string): path of the npz file, see table_path
+        C (dict): place name ---> list with candidate geonameids
+        geodata (dict): geonames data, see distance.QueryObject
+        snapshot (string): id of the geonames snapshot,
+            see geohelpers.geo_names_snapshot
+    Returns:
+        FeatureTable
+    """
+    key = table_key(C, snapshot)
+    if os.path.exists(path):
+        table = FeatureTable.load(path)
+        if table.key == key:
+            logging.info("loaded feature table from {}".format(path))
+            return table
+        logging.info("feature table {} is outdated".format(path))
+    logging.info("computing feature table...")
+    table = FeatureTable.build(C, geodata, key=key)
+    table.save(path)
+    logging.info("feature table with {} rows stored to {}".format(
+        len(table.pids), path))
+    return table
@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+from array import array
+from collections.abc import Mapping
+import numpy as np
+from utils import int2loglevel
+
+
+CACHE_VERSION = 1
+
+#text fields that are kept per row, in this order, in the record blob
+RECORD_FIELDS = ["name"
+        , "asciiname"
+        , "alternatenames"
+        , "latitude"
+        , "longitude"
+        , "population"]
+
+#column index of the record fields in allCountries.txt
+RECORD_COLUMNS = [1, 2, 3, 4, 5, 14]
+
+
+def source_signature(path, latlngminmax=None):
+    """Describes the state of a geonames source file
+
+    Args:
+        path (string): path to allCountries.txt
+        latlngminmax (list): lat lng filter used for reading
+    Returns:
+        dict with size, mtime and filter, a compiled cache is valid if it
+        was built with exactly this signature
+    """
+    st = os.stat(path)
+    return {"version": CACHE_VERSION
+            , "size": st.st_size
+            , "mtime": st.st_mtime
+            , "latlngminmax": [list(x) for x in latlngminmax] if latlngminmax else None}
+
+
+def snapshot_id(path, latlngminmax=None):
+    """Returns a short hash of source_signature, identifies the geonames
+    snapshot that results (e.g. candidates) were computed with"""
+
+    signature = json.dumps(source_signature(path, latlngminmax), sort_keys=True)
+    return hashlib.sha1(signature.encode("utf8")).hexdigest()
+
+
+def _meta_path(cache_dir):
+    return os.path.join(cache_dir, "meta.json")
+
+
+def cache_is_valid(path, cache_dir, latlngminmax=None):
+    """Checks whether the compiled cache in cache_dir matches the source"""
+
+    if not os.path.exists(_meta_path(cache_dir)):
+        return False
+    with open(_meta_path(cache_dir), "r") as f:
+        meta = json.load(f)
+    return meta.get("signature") == source_signature(path, latlngminmax)
+
+
+def compile_geo_names(path="../geodata/allCountries.txt"
+        , cache_dir="../geodata/compiled/"
+        , latlngminmax=[(31,58),(-9.5,38)]):
+    """Compiles the geoname table into columnar numpy files
+
+    The text is parsed once, afterwards the table can be opened with
+    open_geo_names in well under a second. Per row we store the geonameid,
+    latitude, longitude and population as numpy columns, and the raw text
+    fields (see RECORD_FIELDS) in one utf8 blob with row offsets, so that
+    the table yields exactly the same strings as read_geo_names.
+
+    Args:
+        path (string): path to allCountries.txt
+        cache_dir (string): directory where the compiled files are written
+        latlngminmax (list): only keep places inside this box,
+            e.g. [(minlat, maxlat), (minlng, maxlng)]
+    Returns:
+        None
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    #invalidate old cache first, meta is written last
+    if os.path.exists(_meta_path(cache_dir)):
+        os.remove(_meta_path(cache_dir))
+
+    ids = array("q")
+    lats = array("d")
+    lngs = array("d")
+    pops = array("q")
+    offsets = array("q", [0])
+    kickedout = 0
+
+    logging.info("compiling geonames from {} into {}".format(path, cache_dir))
+    with open(path, "r") as f, open(os.path.join(cache_dir, "records.bin"), "wb") as fout:
+        for line in f:
+            spl = line.split("\t")
+            lat = float(spl[4])
+            lng = float(spl[5])
+            if latlngminmax:
+                if lat < latlngminmax[0][0] or lat > latlngminmax[0][1]:
+                    kickedout+=1
+                    continue
+                if lng < latlngminmax[1][0] or lng > latlngminmax[1][1]:
+                    kickedout+=1
+                    continue
+
+            ids.append(int(spl[0]))
+            lats.append(lat)
+            lngs.append(lng)
+            pops.append(int(spl[14] or 0))
+            record = "\t".join([spl[c] for c in RECORD_COLUMNS]).encode("utf8")
+            fout.write(record)
+            offsets.append(offsets[-1] + len(record))
+
+            if len(ids) % 100000 == 0:
+                logging.info("{} geonames names compiled".format(len(ids)))
+                logging.info("{} names kicked out due to exceeding lat lng minmax".format(kickedout))
+
+    ids = np.frombuffer(ids, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    np.save(os.path.join(cache_dir, "ids.npy"), ids)
+    np.save(os.path.join(cache_dir, "sorted_ids.npy"), ids[order])
+    np.save(os.path.join(cache_dir, "sorted_rows.npy"), order.astype(np.int64))
+    np.save(os.path.join(cache_dir, "latitude.npy"), np.frombuffer(lats, dtype=np.float64))
+    np.save(os.path.join(cache_dir, "longitude.npy"), np.frombuffer(lngs, dtype=np.float64))
+    np.save(os.path.join(cache_dir, "population.npy"), np.frombuffer(pops, dtype=np.int64))
+    np.save(os.path.join(cache_dir, "offsets.npy"), np.frombuffer(offsets, dtype=np.int64))
+
+    with open(_meta_path(cache_dir), "w") as f:
+        f.write(json.dumps({"signature": source_signature(path, latlngminmax)
+            , "rows": len(ids)
+            , "compiled_at": time.time()}, indent=4))
+    logging.info("compiled {} geonames, {} kicked out".format(len(ids), kickedout))
+    return None
+
+
+def open_geo_names(path="../geodata/allCountries.txt"
+        , cache_dir="../geodata/compiled/"
+        , latlngminmax=[(31,58),(-9.5,38)]):
+    """Opens the compiled geoname table, (re)compiles it if it is missing
+    or if the source file or the lat lng filter changed
+
+    Returns:
+        GeoNamesTable
+    """
+    if not cache_is_valid(path, cache_dir, latlngminmax):
+        logging.info("no valid compiled geonames found in {}".format(cache_dir))
+        compile_geo_names(path, cache_dir, latlngminmax)
+    return GeoNamesTable(cache_dir)
+
+
+def _read_meta(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def open_derived(cache_dir, name, build, load):
+    """Opens a structure derived from the compiled table, e.g. a name index
+
+    The structure lives in a sub directory of cache_dir and is rebuilt
+    whenever the table was compiled anew.
+
+    Args:
+        cache_dir (string): directory of the compiled table
+        name (string): name of the sub directory
+        build (function): path ---> None, builds and writes the structure
+        load (function): path ---> structure
+    Returns:
+        the loaded structure
+    """
+    path = os.path.join(cache_dir, name)
+    table_meta = _read_meta(_meta_path(cache_dir))
+    if _read_meta(_meta_path(path)) != table_meta:
+        logging.info("building {} in {}".format(name, path))
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(_meta_path(path)):
+            os.remove(_meta_path(path))
+        build(path)
+        with open(_meta_path(path), "w") as f:
+            f.write(json.dumps(table_meta, indent=4))
+    return load(path)
+
+
+class GeoNamesTable(Mapping):
+
+    def __init__(self, cache_dir):
+        """Read-only, memory-mapped view on a compiled geoname table
+
+        Behaves like the dictionary returned by read_geo_names, i.e., maps
+        geonameid strings to dictionaries with "geonameid", "name",
+        "asciiname", "alternatenames", "latitude", "longitude"
+        and "population", but only the requested rows are decoded.
+        The numeric columns are available as numpy arrays (attributes
+        latitude, longitude, population, ids) for vectorized access.
+
+        Args:
+            cache_dir (string): directory with compiled files
+                (see compile_geo_names)
+        """
+        self.cache_dir = cache_dir
+        load = lambda name: np.asarray(np.load(os.path.join(cache_dir, name + ".npy"), mmap_mode="r"))
+        self.ids = load("ids")
+        self.sorted_ids = load("sorted_ids")
+        self.sorted_rows = load("sorted_rows")
+        self.latitude = load("latitude")
+        self.longitude = load("longitude")
+        self.population = load("population")
+        self.offsets = load("offsets")
+        if len(self.ids):
+            self.records = np.asarray(np.memmap(os.path.join(cache_dir, "records.bin")
+                , dtype=np.uint8, mode="r"))
+        else:
+            self.records = np.zeros(0, dtype=np.uint8)
+        return None
+
+    def __reduce__(self):
+        #worker processes re-open the memory map instead of copying arrays
+        return (GeoNamesTable, (self.cache_dir,))
+
+    def row(self, idx):
+        """returns the row of a geonameid, raises KeyError if unknown"""
+
+        try:
+            key = int(idx)
+        except (TypeError, ValueError):
+            raise KeyError(idx)
+        pos = np.searchsorted(self.sorted_ids, key)
+        if pos == len(self.sorted_ids) or self.sorted_ids[pos] != key:
+            raise KeyError(idx)
+        return int(self.sorted_rows[pos])
+
+    def record(self, row):
+        """returns the raw text fields of a row"""
+
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.records[start:end].tobytes().decode("utf8").split("\t")
+
+    def __getitem__(self, idx):
+        row = self.row(idx)
+        fields = self.record(row)
+        out = {"geonameid": str(self.ids[row])}
+        for name, value in zip(RECORD_FIELDS, fields):
+            if name == "alternatenames":
+                out[name] = [string.strip() for string in value.split(",")]
+            else:
+                out[name] = value
+        return out
+
+    def __contains__(self, idx):
+        try:
+            self.row(idx)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        for idx in self.ids:
+            yield str(idx)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-geonames_path", nargs="?"
+            , default="../geodata/allCountries.txt", type=str
+            , help="path to geonames allCountries.txt")
+
+    parser.add_argument("-cache_dir", nargs="?"
+            , default="../geodata/compiled/", type=str
+            , help="directory where the compiled table is written")
+
+    parser.add_argument("-log_level", nargs="?",default=1, type=int,
+            help="logging level, 1: info, 2: debug, 0: ciritcal")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = get_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s'
+            ,level=int2loglevel(args.log_level))
+    compile_geo_names(args.geonames_path, args.cache_dir)
@@ -0,0 +1,332 @@
+import math
+import logging
+import numpy as np
+
+
+#WGS-84 ellipsoid in km
+MAJOR = 6378.137
+MINOR = 6356.7523142
+FLATTENING = 1 / 298.257223563
+
+#mean earth radius in km, used for haversine
+EARTH_RADIUS = 6371.009
+
+METHODS = ["vincenty", "haversine", "karney"]
+
+#pairwise computes blocks with up to this many pairs point by point
+SMALL_BLOCK = 32
+
+#lower bound of the distance in km per degree latitude difference, the 
+#shortest meridian degree has 110.574 km on WGS-84 (at the equator)
+#and 111.195 km on the sphere of haversine
+MIN_KM_PER_DEGREE_LAT = 110.5
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """great circle distance in km on a sphere with radius EARTH_RADIUS
+
+    All arguments are degrees, scalars or arrays that broadcast
+    against each other.
+    """
+    lat1, lng1, lat2, lng2 = [np.radians(np.asarray(x, dtype=np.float64))
+            for x in (lat1, lng1, lat2, lng2)]
+    a = np.sin((lat2 - lat1) / 2) ** 2 \
+            + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def vincenty(lat1, lng1, lat2, lng2, iterations=20):
+    """distance in km on the WGS-84 ellipsoid with Vincenty's inverse formula
+
+    Vectorized version of the (former) geopy.distance.vincenty, all
+    arguments are degrees, scalars or arrays that broadcast against each
+    other. Every element iterates until it converged, elements that did
+    not converge after the given iterations (nearly antipodal points)
+    are computed with karney, or haversine if geographiclib is missing.
+    """
+    lat1, lng1, lat2, lng2 = np.broadcast_arrays(*[
+        np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lng1, lat2, lng2)])
+    f = FLATTENING
+    delta_lng = lng2 - lng1
+
+    reduced_lat1 = np.arctan((1 - f) * np.tan(lat1))
+    reduced_lat2 = np.arctan((1 - f) * np.tan(lat2))
+
+    sin_reduced1, cos_reduced1 = np.sin(reduced_lat1), np.cos(reduced_lat1)
+    sin_reduced2, cos_reduced2 = np.sin(reduced_lat2), np.cos(reduced_lat2)
+
+    lambda_lng = delta_lng.copy()
+    lambda_prime = np.full(delta_lng.shape, 2 * np.pi)
+
+    #values of the last iteration of every element
+    sin_sigma = np.zeros(delta_lng.shape)
+    cos_sigma = np.zeros(delta_lng.shape)
+    sigma = np.zeros(delta_lng.shape)
+    cos_sq_alpha = np.zeros(delta_lng.shape)
+    cos2_sigma_m = np.zeros(delta_lng.shape)
+
+    active = np.ones(delta_lng.shape, dtype=bool)
+    i = 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        while active.any() and i <= iterations:
+            i += 1
+            sin_lambda_lng, cos_lambda_lng = np.sin(lambda_lng), np.cos(lambda_lng)
+
+            s_sigma = np.sqrt(
+                (cos_reduced2 * sin_lambda_lng) ** 2 +
+                (cos_reduced1 * sin_reduced2 -
+                 sin_reduced1 * cos_reduced2 * cos_lambda_lng) ** 2
+            )
+            c_sigma = (
+                sin_reduced1 * sin_reduced2 +
+                cos_reduced1 * cos_reduced2 * cos_lambda_lng
+            )
+            sig = np.arctan2(s_sigma, c_sigma)
+            sin_alpha = cos_reduced1 * cos_reduced2 * sin_lambda_lng / s_sigma
+            c_sq_alpha = 1 - sin_alpha ** 2
+            c2_sigma_m = np.where(c_sq_alpha != 0
+                    , c_sigma - 2 * (sin_reduced1 * sin_reduced2 / c_sq_alpha)
+                    , 0.0)
+            C = f / 16. * c_sq_alpha * (4 + f * (4 - 3 * c_sq_alpha))
+
+            sin_sigma[active] = s_sigma[active]
+            cos_sigma[active] = c_sigma[active]
+            sigma[active] = sig[active]
+            cos_sq_alpha[active] = c_sq_alpha[active]
+            cos2_sigma_m[active] = c2_sigma_m[active]
+
+            #coincident points are done
+            active &= s_sigma != 0
+
+            new_lambda = (
+                delta_lng + (1 - C) * f * sin_alpha * (
+                    sig + C * s_sigma * (
+                        c2_sigma_m + C * c_sigma * (
+                            -1 + 2 * c2_sigma_m ** 2
+                        )
+                    )
+                )
+            )
+            lambda_prime = np.where(active, lambda_lng, lambda_prime)
+            lambda_lng = np.where(active, new_lambda, lambda_lng)
+            active &= np.abs(lambda_lng - lambda_prime) > 10e-12
+
+    u_sq = cos_sq_alpha * (MAJOR ** 2 - MINOR ** 2) / MINOR ** 2
+
+    A = 1 + u_sq / 16384. * (
+        4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq))
+    )
+
+    B = u_sq / 1024. * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+
+    delta_sigma = (
+        B * sin_sigma * (
+            cos2_sigma_m + B / 4. * (
+                cos_sigma * (
+                    -1 + 2 * cos2_sigma_m ** 2
+                ) - B / 6. * cos2_sigma_m * (
+                    -3 + 4 * sin_sigma ** 2
+                ) * (
+                    -3 + 4 * cos2_sigma_m ** 2
+                )
+            )
+        )
+    )
+
+    s = MINOR * A * (sigma - delta_sigma)
+    s = np.where(sin_sigma == 0, 0.0, s)
+
+    if active.any():
+        logging.warning("vincenty did not converge for {} point pairs, \
+                using karney".format(active.sum()))
+        deg = [np.degrees(x[active]) for x in (lat1, lng1, lat2, lng2)]
+        s[active] = karney(*deg)
+    return s
+
+
+def karney(lat1, lng1, lat2, lng2):
+    """distance in km on the WGS-84 ellipsoid with Karney's algorithm
+
+    Exact and always converging, but computed per pair with geographiclib
+    (falls back to haversine if geographiclib is not installed).
+    """
+    try:
+        from geographiclib.geodesic import Geodesic
+    except ImportError:
+        logging.warning("geographiclib not installed, using haversine")
+        return haversine(lat1, lng1, lat2, lng2)
+    inverse = np.vectorize(lambda a, b, c, d:
+            Geodesic.WGS84.Inverse(a, b, c, d, Geodesic.DISTANCE)["s12"] / 1000.
+            , otypes=[np.float64])
+    return inverse(lat1, lng1, lat2, lng2)
+
+
+def distance(lat1, lng1, lat2, lng2, method="vincenty"):
+    """distances in km between points, arguments broadcast like numpy arrays
+
+    Args:
+        lat1, lng1, lat2, lng2: degrees, scalars or arrays
+        method (string): vincenty, haversine or karney
+    Returns:
+        np.array with distances (0-d for scalar input)
+    """
+    if method == "vincenty":
+        return vincenty(lat1, lng1, lat2, lng2)
+    if method == "haversine":
+        return haversine(lat1, lng1, lat2, lng2)
+    if method == "karney":
+        return karney(lat1, lng1, lat2, lng2)
+    raise ValueError("unknown distance method {}".format(method))
+
+
+def _vincenty_scalar(lat1, lng1, lat2, lng2, iterations=20):
+    """vincenty for two points given as floats, same as vincenty, but
+    without numpy overhead"""
+
+    f = FLATTENING
+    lat1, lng1 = math.radians(lat1), math.radians(lng1)
+    lat2, lng2 = math.radians(lat2), math.radians(lng2)
+    delta_lng = lng2 - lng1
+
+    reduced_lat1 = math.atan((1 - f) * math.tan(lat1))
+    reduced_lat2 = math.atan((1 - f) * math.tan(lat2))
+
+    sin_reduced1, cos_reduced1 = math.sin(reduced_lat1), math.cos(reduced_lat1)
+    sin_reduced2, cos_reduced2 = math.sin(reduced_lat2), math.cos(reduced_lat2)
+
+    lambda_lng = delta_lng
+    lambda_prime = 2 * math.pi
+
+    i = 0
+    while (i == 0 or
+           (abs(lambda_lng - lambda_prime) > 10e-12 and i <= iterations)):
+        i += 1
+
+        sin_lambda_lng, cos_lambda_lng = math.sin(lambda_lng), math.cos(lambda_lng)
+
+        sin_sigma = math.sqrt(
+            (cos_reduced2 * sin_lambda_lng) ** 2 +
+            (cos_reduced1 * sin_reduced2 -
+             sin_reduced1 * cos_reduced2 * cos_lambda_lng) ** 2
+        )
+
+        if sin_sigma == 0:
+            return 0.0
+
+        cos_sigma = (
+            sin_reduced1 * sin_reduced2 +
+            cos_reduced1 * cos_reduced2 * cos_lambda_lng
+        )
+
+        sigma = math.atan2(sin_sigma, cos_sigma)
+
+        sin_alpha = cos_reduced1 * cos_reduced2 * sin_lambda_lng / sin_sigma
+        cos_sq_alpha = 1 - sin_alpha ** 2
+
+        if cos_sq_alpha != 0:
+            cos2_sigma_m = cos_sigma - 2 * (
+                sin_reduced1 * sin_reduced2 / cos_sq_alpha
+            )
+        else:
+            cos2_sigma_m = 0.0
+
+        C = f / 16. * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+
+        lambda_prime = lambda_lng
+        lambda_lng = (
+            delta_lng + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (
+                    cos2_sigma_m + C * cos_sigma * (
+                        -1 + 2 * cos2_sigma_m ** 2
+                    )
+                )
+            )
+        )
+
+    if i > iterations:
+        return float(karney(math.degrees(lat1), math.degrees(lng1)
+            , math.degrees(lat2), math.degrees(lng2)))
+
+    u_sq = cos_sq_alpha * (MAJOR ** 2 - MINOR ** 2) / MINOR ** 2
+
+    A = 1 + u_sq / 16384. * (
+        4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq))
+    )
+
+    B = u_sq / 1024. * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+
+    delta_sigma = (
+        B * sin_sigma * (
+            cos2_sigma_m + B / 4. * (
+                cos_sigma * (
+                    -1 + 2 * cos2_sigma_m ** 2
+                ) - B / 6. * cos2_sigma_m * (
+                    -3 + 4 * sin_sigma ** 2
+                ) * (
+                    -3 + 4 * cos2_sigma_m ** 2
+                )
+            )
+        )
+    )
+
+    return MINOR * A * (sigma - delta_sigma)
+
+
+def point_distance(lat1, lng1, lat2, lng2, method="vincenty"):
+    """distance in km between two points given as floats (degrees)
+
+    Same as distance, but for single pairs, without numpy overhead.
+    """
+    if method == "vincenty":
+        return _vincenty_scalar(lat1, lng1, lat2, lng2)
+    return float(distance(lat1, lng1, lat2, lng2, method=method))
+
+
+def pairwise(lat1, lng1, lat2, lng2, method="vincenty"):
+    """matrix with distances in km from every point 1 to every point 2
+
+    Args:
+        lat1, lng1 (array): n points
+        lat2, lng2 (array): m points
+        method (string): vincenty, haversine or karney
+    Returns:
+        np.array with shape (n, m)
+    """
+    lat1 = np.asarray(lat1, dtype=np.float64)[:, None]
+    lng1 = np.asarray(lng1, dtype=np.float64)[:, None]
+    lat2 = np.asarray(lat2, dtype=np.float64)[None, :]
+    lng2 = np.asarray(lng2, dtype=np.float64)[None, :]
+    if method == "vincenty" and lat1.size * lat2.size <= SMALL_BLOCK:
+        #numpy overhead dominates for few pairs
+        points1 = list(zip(lat1[:, 0].tolist(), lng1[:, 0].tolist()))
+        points2 = list(zip(lat2[0].tolist(), lng2[0].tolist()))
+        return np.array([[_vincenty_scalar(y, x, ybar, xbar) for ybar, xbar in points2]
+            for y, x in points1]).reshape(lat1.size, lat2.size)
+    return distance(lat1, lng1, lat2, lng2, method=method)
+
+
+def paired(lat1, lng1, lat2, lng2, method="vincenty"):
+    """distances in km from the i-th point 1 to the i-th point 2
+
+    Args:
+        lat1, lng1 (array): n points
+        lat2, lng2 (array): n points
+        method (string): vincenty, haversine or karney
+    Returns:
+        np.array with n distances
+    """
+    if method == "vincenty" and len(lat1) <= SMALL_BLOCK:
+        return np.array([_vincenty_scalar(*point) for point in zip(np.asarray(lat1).tolist()
+            , np.asarray(lng1).tolist(), np.asarray(lat2).tolist()
+            , np.asarray(lng2).tolist())], dtype=np.float64)
+    return distance(lat1, lng1, lat2, lng2, method=method)
+
+
+def lower_bound(lat1, lat2):
+    """lower bound in km of the distance between points with latitudes 
+    lat1 and lat2 (degrees, arrays that broadcast), for all methods
+
+    The distance between two points is at least the length of the
+    meridian arc between their parallels.
+    """
+    return MIN_KM_PER_DEGREE_LAT * np.abs(np.asarray(lat1) - np.asarray(lat2))
@@ -1,6 +1,12 @@
 import logging
+import multiprocessing
 import numpy as np
 import Levenshtein
+import geocache
+from nameindex import NameIndex
+from bktree import BKTree
+from ngramindex import NGramIndex
+from candidatestore import CandidateLog
 from constants import UNKNOWN
 
 
@@ -16,9 +22,14 @@ def dummy_info_dict(y, x, interpolidxs=[""]):
     return dic
 
 
-def read_geo_names(paths=["../geodata/allCountries.txt","../geodata/alternateNames.txt"], return_inverted_index=True, latlngminmax=[(31,58),(-9.5,38)]):
+def read_geo_names(paths=["../geodata/allCountries.txt","../geodata/alternateNames.txt"], return_inverted_index=True, latlngminmax=[(31,58),(-9.5,38)], cache_dir=None):
     
     """    
+    If cache_dir is given, the table is not parsed from text but opened from
+    a compiled, memory-mapped cache (see geocache.py), which is (re)built
+    automatically when allCountries.txt or latlngminmax change. The inverted
+    index (see nameindex.py) is then stored in the cache as well.
+
     The main 'geoname' table has the following fields :
     ---------------------------------------------------
     geonameid         : integer id of record in geonames database
@@ -49,7 +60,17 @@ def read_geo_names(paths=["../geodata/allCountries.txt","../geodata/alternateNam
             ,(5, "longitude")
             ,(14, "population")]
             
-    
+    if cache_dir:
+        out = geocache.open_geo_names(paths[0], cache_dir, latlngminmax)
+        logging.info("{} geonames names loaded from {}".format(len(out), cache_dir))
+        if not return_inverted_index:
+            return out,None
+        ii = geocache.open_derived(cache_dir, "nameindex"
+                , build=lambda path: build_inverted_index(out).save(path)
+                , load=NameIndex.load)
+        logging.info("inverted index loaded; size: {}".format(len(ii)))
+        return out,ii
+
     out = {}
     kickedout=0
     with open(paths[0],"r") as f:
@@ -81,21 +102,23 @@ def read_geo_names(paths=["../geodata/allCountries.txt","../geodata/alternateNam
     if not return_inverted_index:
         return out,None
     
-    #build inv ind
-    ii = {}
-    logging.info("starting building inverted index...")
-    for idx in out:
-        names = [out[idx]["name"]]
-        for n in out[idx]["alternatenames"]:
-            names.append(n)
-        
-        for n in names:
-            if n not in ii:
-                ii[n] = [idx]
-            else:
-                ii[n].append(idx)
-    logging.info("inverted index... finished; size: {}".format(len(ii)))
-    return out,ii
+    return out,build_inverted_index(out)
+
+
+def geo_names_snapshot(paths=["../geodata/allCountries.txt","../geodata/alternateNames.txt"], latlngminmax=[(31,58),(-9.5,38)]):
+    """Returns an id of the geonames data read by read_geo_names with the
+    same arguments, changes when the file or the filter changes"""
+
+    return geocache.snapshot_id(paths[0], latlngminmax)
+
+
+def build_inverted_index(out):
+    """maps every name and alternate name to a list of geonameids
+
+    Returns:
+        NameIndex, behaves like a dict name ---> list with geonameids
+    """
+    return NameIndex.build(out)
         
 
 def id_to_info_dict(idx, geodata):
@@ -151,7 +174,37 @@ def _build(idxs):
     return idxs
 
 
-def _build_candidates(name, ii=None):    
+def load_fuzzy_index(ii, engine="bktree", cache_dir=None):
+    """Returns an index that finds the nearest names of ii
+
+    Args:
+        ii (NameIndex): the inverted index
+        engine (string): "linear" (scan all names, returns None), "bktree"
+            or "trigram" (n-gram count filter before distance computation)
+        cache_dir (string): directory of the compiled geonames table, if
+            given, the index is built once and stored there
+    Returns:
+        object with method nearest(name) ---> list with names that have the
+        minimum Levenshtein distance to name, or None for a linear scan
+    """
+    if engine == "linear":
+        return None
+    if engine == "bktree":
+        if cache_dir and ii.path:
+            return geocache.open_derived(cache_dir, "bktree"
+                    , build=lambda path: BKTree.build(ii).save(path)
+                    , load=lambda path: BKTree.load(ii, path))
+        return BKTree.build(ii)
+    if engine == "trigram":
+        if cache_dir and ii.path:
+            return geocache.open_derived(cache_dir, "trigrams"
+                    , build=lambda path: NGramIndex.build(ii, q=3).save(path)
+                    , load=lambda path: NGramIndex.load(ii, path, q=3))
+        return NGramIndex.build(ii, q=3)
+    raise ValueError("unknown fuzzy index engine {}".format(engine))
+
+
+def _build_candidates(name, ii=None, fuzzy_index=None):    
     
     if name in ii:
         #if we know this name return its candidates
@@ -160,6 +213,11 @@ def _build_candidates(name, ii=None):
     
     #else look up similar names
     found = []
+    if fuzzy_index is not None:
+        for othername in fuzzy_index.nearest(name):
+            found += ii[othername]
+        return _build(list(set(found)))
+
     othernames = [othername for othername in ii]
     dists = []
     md = 1000
@@ -178,21 +236,113 @@ def _build_candidates(name, ii=None):
     return _build(list(set(found)))
 
 
-def build_candidates(uniq_locations, ii=None):
+#read-only lookup structures of a candidate worker process
+_worker_state = {}
+
+
+def _init_candidate_worker(ii, fuzzy_index):
+    _worker_state["ii"] = ii
+    _worker_state["fuzzy_index"] = fuzzy_index
+
+
+def _build_candidates_shard(names):
+    return [(name, _build_candidates(name
+        , ii=_worker_state["ii"]
+        , fuzzy_index=_worker_state["fuzzy_index"])) for name in names]
+
+
+def build_candidates(uniq_locations, ii=None, fuzzy_index=None, processes=1, shard_size=8
+        , store=None, checkpoint_path=None, checkpoint_every=100, snapshot=""):
+    """Builds the candidate map name ---> list with geonameids
+
+    Args:
+        uniq_locations (list): place names
+        ii (NameIndex): inverted index
+        fuzzy_index: see load_fuzzy_index, None for linear scan
+        processes (int): number of worker processes, names are sharded 
+            across them. The workers get the index once at start up 
+            (inherited when forking, memory-mapped indices are re-opened 
+            otherwise), not with every shard
+        shard_size (int): number of names per task
+        store (CandidateStore): if given, names that are in the store are
+            taken from it, only the missing names are computed and then
+            added to the store
+        checkpoint_path (string): if given, computed candidates are appended
+            to this log every checkpoint_every names, and names that are
+            already in the log (from an interrupted run of the same 
+            snapshot) are skipped. The log is removed when all candidates
+            are built
+        checkpoint_every (int): see checkpoint_path
+        snapshot (string): id of the geonames snapshot (see 
+            geo_names_snapshot) that is written to the checkpoint log,
+            the snapshot of the store if a store is given
+    Returns:
+        dict name ---> list with geonameids
+    """
+    
+    if store is not None:
+        stored = store.get_many(set(uniq_locations))
+        missing = [name for name in uniq_locations if name not in stored]
+        logging.info("{} names found in candidate store, {} missing".format(
+            len(stored), len(set(missing))))
+        C = build_candidates(missing, ii=ii, fuzzy_index=fuzzy_index
+                , processes=processes, shard_size=shard_size
+                , checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every
+                , snapshot=store.snapshot)
+        store.put_many(C)
+        stored.update(C)
+        return {name: stored[name] for name in uniq_locations}
+
+    if checkpoint_path:
+        log = CandidateLog(checkpoint_path, snapshot=snapshot, flush_every=checkpoint_every)
+        C = log.read()
+        missing = [name for name in uniq_locations if name not in C]
+        for name, candidates in _iter_candidates(missing, ii, fuzzy_index
+                , processes, shard_size):
+            log.add(name, candidates)
+            C[name] = candidates
+        log.clear()
+    else:
+        C = dict(_iter_candidates(uniq_locations, ii, fuzzy_index
+            , processes, shard_size))
     
-    C = {}
-     
+    return {name: C[name] for name in uniq_locations}
+
+
+def _iter_candidates(uniq_locations, ii, fuzzy_index, processes, shard_size):
+    """yields (name, candidates) for all names, in input order if computed
+    sequentially, in order of completion if computed by processes"""
+
+    if processes > 1:
+        yield from _iter_candidates_parallel(uniq_locations, ii, fuzzy_index
+                , processes, shard_size)
+        return None
+
     for i, name in enumerate(uniq_locations):
         logging.info("searching candidates for {}...".format(name))
-        candidates = _build_candidates(name, ii=ii)
+        candidates = _build_candidates(name, ii=ii, fuzzy_index=fuzzy_index)
         logging.info("candidates found: {}".format(candidates))
-        C[name] = candidates
+        yield name, candidates
         if i % 10 == 0:
             logging.info("{}/{} regest names processed, candidates created".format(i, len(uniq_locations)))
         if i % 1000 == 0:
             logging.critical("{}/{} regest names processed, candidates created".format(i, len(uniq_locations)))
     
-    return C
+
+def _iter_candidates_parallel(uniq_locations, ii, fuzzy_index, processes, shard_size):
+    
+    names = list(dict.fromkeys(uniq_locations))
+    shards = [names[i:i+shard_size] for i in range(0, len(names), shard_size)]
+    
+    logging.info("searching candidates for {} names with {} processes".format(
+        len(names), processes))
+    with multiprocessing.Pool(processes
+            , initializer=_init_candidate_worker
+            , initargs=(ii, fuzzy_index)) as pool:
+        for i, shard in enumerate(pool.imap_unordered(_build_candidates_shard, shards)):
+            yield from shard
+            logging.info("{}/{} shards processed, candidates created".format(
+                i + 1, len(shards)))
 
 
 def maybe_extend_candidates(C, ii, strategy=None, entity_types={}):
@@ -1,14 +1,19 @@
 import data_helpers as dh
 import json
-import numpy as np
 import geohelpers as gh
-from search import search, resolve_places_in_regests
+from search import solve_itinerary, solve_partitioned_itinerary, beam_report
+from search import resolve_places_in_regests
 import logging
 import os
 import distance as ds
 import statistics
 import argparse
+import copy
 from utils import int2loglevel
+from candidatestore import CandidateStore, CandidateLog
+from featuretable import open_feature_table, table_path
+from distancestore import open_distance_store
+from streaming import StreamingSearch
 from constants import UNKNOWN
 
 
@@ -34,9 +39,59 @@ def get_args():
             help="if enabled, we do not look for memorized" \
             "candidate location file but run this processes anew")
 
-    #TODO implement
-    parser.add_argument("--multi_processing", action='store_true', 
-            help="use with caution, not properly implemented")
+    parser.add_argument("-processes", nargs="?", default=1, type=int, 
+            help="number of worker processes for candidate retrieval,\
+                    partitioned itinerary solving and resolution of places\
+                    in texts")
+
+    parser.add_argument("-itinerary_partition", nargs="?", default="", type=str, 
+            choices=["", "issuer", "collection"],
+            help="if set, the itinerary is split by this regest field and\
+                    every part is solved as an own chain (in parallel with\
+                    -processes), default: one chain over all regests")
+
+    parser.add_argument("-beam_width", nargs="?", default=0, type=int, 
+            help="if > 0, the itinerary is solved with beam search, only\
+                    this many candidates per station are extended to the\
+                    next station (faster, but may miss the shortest route)")
+
+    parser.add_argument("-beam_margin", nargs="?", default=0.0, type=float, 
+            help="if > 0, beam search extends only candidates whose\
+                    cumulative cost is within this margin of the best one")
+
+    parser.add_argument("--prune_transitions", action='store_true', 
+            help="compute only traveling costs between candidates that can\
+                    be on the shortest route (lower bound pruning, same result)")
+
+    parser.add_argument("-max_km_per_day", nargs="?", default=0.0, type=float, 
+            help="if > 0, transitions between consecutive regests that would\
+                    require traveling faster than this (given their dates)\
+                    are not allowed")
+
+    parser.add_argument("-infeasible_penalty", nargs="?", default=1000.0, type=float, 
+            help="cost added to the transitions to a regest that cannot be\
+                    reached with -max_km_per_day (all transitions are allowed then)")
+
+    parser.add_argument("-coarse_radius", nargs="?", default=0.0, type=float, 
+            help="if > 0, candidates of a name within this radius (km) are\
+                    clustered, the itinerary is first solved over the clusters\
+                    and then over the members of the chosen clusters (faster,\
+                    but may miss the shortest route)")
+
+    parser.add_argument("--beam_report", action='store_true', 
+            help="compare beam search of different beam widths with the\
+                    exact search on the itinerary and log the differences")
+
+    parser.add_argument("-stream_state_path", nargs="?", default="", type=str, 
+            help="if given, the itinerary is decoded incrementally: the\
+                    decoder state (Viterbi frontier of every chain) is loaded\
+                    from this file, only regests that were not decoded before\
+                    are appended, and the state is written back")
+
+    parser.add_argument("-stream_lag", nargs="?", default=50, type=int, 
+            help="fixed lag of incremental decoding, decisions for stations\
+                    more than this many stations behind the end of their\
+                    chain are not changed any more")
 
     parser.add_argument("--simple_candidate_extension", action='store_true', 
             help="if a name is stated with multiple tokens, look up direct hits in\
@@ -52,6 +107,11 @@ def get_args():
     parser.add_argument("-text_place_solver", nargs="?",default="stochastic", 
             help="method to resolve place-names in text")
 
+    parser.add_argument("-text_solver_seed", nargs="?", default=None, type=int, 
+            help="if given, the random choices of the text place solver are\
+                    seeded per regest, results are then reproducible and\
+                    the same for any number of -processes")
+
     parser.add_argument("-entity_file_path", nargs="?",
             default="resources/ENTITIES.json", type=str, 
             help="path to store entities or load entities from")
@@ -60,6 +120,22 @@ def get_args():
             default="resources/CANDIDATES.json", type=str, 
             help="path to save place candidates or load candidates from")
     
+    parser.add_argument("-candidate_store_path", nargs="?", 
+            default="", type=str, 
+            help="path to a sqlite candidate store. If given, candidates\
+                    are looked up per name in the store and only missing names\
+                    (or names computed with another geonames snapshot) are\
+                    retrieved and added to the store")
+    
+    parser.add_argument("-candidate_checkpoint_path", nargs="?", 
+            default="", type=str, 
+            help="path to a log to which retrieved candidates are appended\
+                    while retrieving, a restarted run skips names in the log")
+
+    parser.add_argument("-candidate_checkpoint_every", nargs="?", 
+            default=100, type=int, 
+            help="number of names after which the candidate log is written")
+    
     parser.add_argument("-RI_as_json_path", nargs="?", 
             default="../ri-data/RI.json", type=str, 
             help="path to load all regests")
@@ -68,10 +144,50 @@ def get_args():
             default="../ri-data/entity_types.txt", type=str, 
             help="path to entity type list")
 
+    parser.add_argument("-distance_method", nargs="?", default="vincenty", type=str, 
+            choices=["vincenty", "haversine", "karney"],
+            help="geodesic distance used for traveling costs")
+
+    parser.add_argument("-transition_cache_mb", nargs="?", default=512, type=float, 
+            help="memory (MB) for distance matrices between the candidates\
+                    of two consecutive place names that are kept in memory")
+
+    parser.add_argument("-feature_cache_size", nargs="?", default=1000000, type=int, 
+            help="number of place feature vectors that are kept in memory")
+
+    parser.add_argument("-distance_cache_size", nargs="?", default=0, type=int, 
+            help="if > 0, this many distances between two places computed\
+                    by the text resolution are kept in memory")
+
+    parser.add_argument("-distance_store_path", nargs="?", default="", type=str, 
+            help="if given, distances between the candidates of the most\
+                    frequent place names are precomputed once and stored\
+                    (memory-mapped) in this directory")
+
+    parser.add_argument("-distance_store_places", nargs="?", default=10000, type=int, 
+            help="maximum number of candidates in the distance store,\
+                    needs 4 * places^2 bytes of disk space")
+
     parser.add_argument("-ner_method", nargs="?",default="spacy", type=str, 
             help="spacy or stanza")
+
+    parser.add_argument("-geonames_cache_dir", nargs="?", 
+            default="../geodata/compiled/", type=str, 
+            help="directory of the compiled geonames table, built on first use\
+                    and rebuilt if the geonames file changes. Set to empty\
+                    string to parse the text file on every run")
+
+    parser.add_argument("-fuzzy_engine", nargs="?", default="bktree", type=str, 
+            choices=["linear", "bktree", "trigram"],
+            help="how names that are not in geonames are matched to their\
+                    closest geonames names: linear (compare against every\
+                    name), bktree or trigram (indices, same result, much\
+                    faster)")
     
     arguments = parser.parse_args()
+
+    if arguments.stream_state_path and arguments.coarse_radius:
+        parser.error("-coarse_radius is not supported with -stream_state_path")
     
     return arguments
 
@@ -122,13 +238,36 @@ if __name__ == '__main__':
     print(list(sorted(uniq_locations, key = len, reverse=True)))
 
     #load geodata
-    geonames, ii = gh.read_geo_names()
+    geonames, ii = gh.read_geo_names(cache_dir=args.geonames_cache_dir)
 
     CANDIDATE_EXISTS=os.path.exists(args.place_candidate_file_path)
 
+    #a fresh run does not continue an interrupted candidate retrieval
+    if args.candidate_checkpoint_path and (args.fresh_run or args.fresh_candidates):
+        CandidateLog(args.candidate_checkpoint_path).clear()
+
     #build candidate sets for every name in unique place names
 
-    if CANDIDATE_EXISTS and not args.fresh_run and not args.fresh_candidates:
+    if args.candidate_store_path:
+
+        store = CandidateStore(args.candidate_store_path, gh.geo_names_snapshot())
+        if args.fresh_run or args.fresh_candidates:
+            store.clear()
+        store.drop_outdated()
+        fuzzy_index = gh.load_fuzzy_index(ii, engine=args.fuzzy_engine
+                , cache_dir=args.geonames_cache_dir)
+        C = gh.build_candidates(uniq_locations, ii=ii, fuzzy_index=fuzzy_index
+                , processes=args.processes, store=store
+                , checkpoint_path=args.candidate_checkpoint_path
+                , checkpoint_every=args.candidate_checkpoint_every)
+        store.close()
+        logging.info("candidates retrieved, storing to {}".format(
+            args.place_candidate_file_path))
+        
+        with open(args.place_candidate_file_path,"w") as f:
+            f.write(json.dumps(C, indent=4, sort_keys=True))
+
+    elif CANDIDATE_EXISTS and not args.fresh_run and not args.fresh_candidates:
         
         logging.info("load saved place candidates from {}".format(
             args.place_candidate_file_path))
@@ -142,7 +281,13 @@ if __name__ == '__main__':
     elif not CANDIDATE_EXISTS or args.fresh_run or args.fresh_candidates:
 
         logging.info("retrieving candidates.... this may take a while...")
-        C = gh.build_candidates(uniq_locations, ii=ii)
+        fuzzy_index = gh.load_fuzzy_index(ii, engine=args.fuzzy_engine
+                , cache_dir=args.geonames_cache_dir)
+        C = gh.build_candidates(uniq_locations, ii=ii, fuzzy_index=fuzzy_index
+                , processes=args.processes
+                , checkpoint_path=args.candidate_checkpoint_path
+                , checkpoint_every=args.candidate_checkpoint_every
+                , snapshot=gh.geo_names_snapshot())
         logging.info("retrieving retrieved, stroing to {}".format(
             args.place_candidate_file_path))
 
@@ -171,8 +316,28 @@ if __name__ == '__main__':
                             c_stats[1], c_stats[2], c_stats[3]))
 
 
+    #feature vectors of all candidates, stored next to the candidates
+    features = open_feature_table(table_path(args.place_candidate_file_path)
+            , C, geonames, snapshot=gh.geo_names_snapshot())
+
+    #distances between candidates of frequent names, computed once
+    distances = None
+    if args.distance_store_path:
+        distances = open_distance_store(args.distance_store_path, C
+                , names + additional_locs, geonames
+                , max_places=args.distance_store_places
+                , method=args.distance_method
+                , snapshot=gh.geo_names_snapshot())
+
     #intitalize query object
-    QO = ds.QueryObject(geonames, costfun=ds.cost1)
+    QO = ds.IndexedQueryObject(geonames, C, costfun=ds.cost1
+            , distance_method=args.distance_method
+            , transition_cache_mb=args.transition_cache_mb
+            , features=features
+            , save_dists=args.distance_cache_size > 0
+            , feature_cache_size=args.feature_cache_size
+            , distance_cache_size=args.distance_cache_size
+            , distances=distances)
 
 
 
@@ -200,6 +365,26 @@ if __name__ == '__main__':
     places_in_regests = []
     path = []
 
+    beam_width = args.beam_width or None
+    beam_margin = args.beam_margin or None
+    days = [dh.regest_days(regest) for regest in regests] if args.max_km_per_day else None
+    if args.beam_report:
+        beam_report(names_not_unknown, C, QO, beam_margin=beam_margin
+                , days=days, max_km_per_day=args.max_km_per_day or None)
+
+    if args.stream_state_path:
+        if os.path.exists(args.stream_state_path) and not args.fresh_run:
+            logging.info("load decoder state from {}".format(args.stream_state_path))
+            stream = StreamingSearch.load(args.stream_state_path)
+        else:
+            stream = StreamingSearch(lag=args.stream_lag)
+        new_regests = [i for i, regest in enumerate(regests) 
+                if not stream.known(regest["uri"])]
+        logging.info("{} regests already decoded, {} new regests".format(
+            len(regests) - len(new_regests), len(new_regests)))
+        #stored unchanged if there are no iterations
+        decoder = stream
+
     #start bootstrapping
     for iteration in range(args.iterations):
         logging.info("starting {}. global iteration".format(iteration))
@@ -208,24 +393,68 @@ if __name__ == '__main__':
 
         
         #resolve itinerary
-        path, cum_dist = search(names_not_unknown
-                , C
-                , QO
-                , init_memory=([0.0]*len(C[names_not_unknown[0]])
-                                , np.full( (len(C[names_not_unknown[0]]),1),-1).tolist()
-                                , C[names_not_unknown[0]])
-                , places_in_regests=places_in_regests
-                )
+        if args.stream_state_path:
+            #every iteration appends the new regests to the loaded state
+            decoder = copy.deepcopy(stream)
+            decoder.extend([names_not_unknown[i] for i in new_regests]
+                    , [regests[i]["uri"] for i in new_regests]
+                    , C
+                    , QO
+                    , keys=[str(regests[i].get(args.itinerary_partition)) 
+                        for i in new_regests] if args.itinerary_partition else None
+                    , places_in_regests=[places_in_regests[i] for i in new_regests]
+                        if places_in_regests else []
+                    , days=[days[i] for i in new_regests] if days else None
+                    , beam_width=beam_width
+                    , beam_margin=beam_margin
+                    , prune=args.prune_transitions
+                    , max_km_per_day=args.max_km_per_day or None
+                    , infeasible_penalty=args.infeasible_penalty
+                    )
+            predictions = decoder.predictions()
+            path = [predictions[regest["uri"]] for regest in regests]
+            cum_dist = decoder.cost()
+        elif args.itinerary_partition:
+            path, cum_dist = solve_partitioned_itinerary(names_not_unknown
+                    , C
+                    , QO
+                    , [str(regest.get(args.itinerary_partition)) for regest in regests]
+                    , places_in_regests=places_in_regests
+                    , processes=args.processes
+                    , beam_width=beam_width
+                    , beam_margin=beam_margin
+                    , prune=args.prune_transitions
+                    , days=days
+                    , max_km_per_day=args.max_km_per_day or None
+                    , infeasible_penalty=args.infeasible_penalty
+                    , coarse_radius=args.coarse_radius or None
+                    )
+        else:
+            path, cum_dist = solve_itinerary(names_not_unknown
+                    , C
+                    , QO
+                    , places_in_regests=places_in_regests
+                    , beam_width=beam_width
+                    , beam_margin=beam_margin
+                    , prune=args.prune_transitions
+                    , days=days
+                    , max_km_per_day=args.max_km_per_day or None
+                    , infeasible_penalty=args.infeasible_penalty
+                    , coarse_radius=args.coarse_radius or None
+                    )
         logging.info("solving emperor routes finished; \
                 cumulative_distance {}".format(cum_dist))
-        path = path[1:]
-        path = [C[name][path[i]] for i, name in enumerate(names_not_unknown)]
         
         places_in_regests, avg_cost = resolve_places_in_regests(
-                names_not_unknown_text, C, QO, path, method=args.text_place_solver)
+                names_not_unknown_text, C, QO, path, method=args.text_place_solver
+                , processes=args.processes, seed=args.text_solver_seed)
         logging.info("solving places in text finished; method={}, \
                 avg cost={}".format(args.text_place_solver, avg_cost))
 
+    if args.stream_state_path:
+        logging.info("storing decoder state to {}".format(args.stream_state_path))
+        decoder.save(args.stream_state_path)
+
     ## checks and creating final output files
     assert len(path) == len(names_not_unknown)
     assert len(places_in_regests) == len(path)
@@ -0,0 +1,163 @@
+import os
+import logging
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+import numpy as np
+
+
+class _SortedNames(Sequence):
+    """utf8 encoded names stored in one blob, sorted, for bisection"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+def _iter_names(geodata):
+    """yields (geonameid as int, [name] + alternatenames) for every place"""
+
+    if hasattr(geodata, "record"):
+        #compiled table, read the raw fields directly
+        for row, idx in enumerate(geodata.ids):
+            fields = geodata.record(row)
+            yield int(idx), [fields[0]] + [string.strip() for string in fields[2].split(",")]
+    else:
+        for idx in geodata:
+            yield int(idx), [geodata[idx]["name"]] + geodata[idx]["alternatenames"]
+
+
+class NameIndex(Mapping):
+
+    def __init__(self, blob, name_offsets, postings_offsets, postings, path=None):
+        """Array-backed inverted index name ---> list with geonameids
+
+        Drop-in replacement for the dictionary that maps every name and
+        alternate name to the geonameids carrying it. Names are kept sorted
+        in a utf8 blob with offsets, lookups bisect over them. The
+        geonameids of the i-th name are postings[postings_offsets[i]:
+        postings_offsets[i+1]] (int32), in the order in which the places
+        occur in the geonames table.
+
+        Args:
+            blob (np.array): uint8, concatenated utf8 encoded sorted names
+            name_offsets (np.array): int64, start of every name in blob
+                plus the end of the blob
+            postings_offsets (np.array): int64, start of every name's
+                postings plus the total number of postings
+            postings (np.array): int32 geonameids
+            path (string): directory the arrays were loaded from, if any
+        """
+        self.blob = blob
+        self.name_offsets = name_offsets
+        self.postings_offsets = postings_offsets
+        self.postings = postings
+        self.path = path
+        self._names = _SortedNames(blob, name_offsets)
+        return None
+
+    @classmethod
+    def build(cls, geodata):
+        """Builds the index for a geonames table (dict or compiled table)"""
+
+        logging.info("starting building inverted index...")
+        codes = array("i")
+        ids = array("i")
+        name2code = {}
+        for idx, names in _iter_names(geodata):
+            for n in names:
+                codes.append(name2code.setdefault(n, len(name2code)))
+                ids.append(idx)
+
+        names = list(name2code)
+        del name2code
+        order = sorted(range(len(names)), key=names.__getitem__)
+        rank = np.empty(len(names), dtype=np.int64)
+        rank[order] = np.arange(len(names))
+
+        pair_rank = rank[np.frombuffer(codes, dtype=np.int32)]
+        perm = np.argsort(pair_rank, kind="stable")
+        postings = np.frombuffer(ids, dtype=np.int32)[perm]
+        counts = np.bincount(pair_rank, minlength=len(names))
+        postings_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        encoded = [names[i].encode("utf8") for i in order]
+        name_offsets = np.concatenate([[0]
+            , np.cumsum([len(n) for n in encoded], dtype=np.int64)]).astype(np.int64)
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        logging.info("inverted index... finished; size: {}".format(len(names)))
+        return cls(blob, name_offsets, postings_offsets, postings)
+
+    def save(self, path):
+        """writes the arrays to a directory, load with NameIndex.load"""
+
+        os.makedirs(path, exist_ok=True)
+        self.blob.tofile(os.path.join(path, "names.bin"))
+        np.save(os.path.join(path, "name_offsets.npy"), self.name_offsets)
+        np.save(os.path.join(path, "postings_offsets.npy"), self.postings_offsets)
+        np.save(os.path.join(path, "postings.npy"), self.postings)
+        return None
+
+    @classmethod
+    def load(cls, path):
+        """memory maps an index written with save"""
+
+        load = lambda name: np.asarray(np.load(os.path.join(path, name + ".npy"), mmap_mode="r"))
+        if os.path.getsize(os.path.join(path, "names.bin")):
+            blob = np.asarray(np.memmap(os.path.join(path, "names.bin")
+                , dtype=np.uint8, mode="r"))
+        else:
+            blob = np.zeros(0, dtype=np.uint8)
+        return cls(blob
+                , load("name_offsets")
+                , load("postings_offsets")
+                , load("postings")
+                , path=path)
+
+    def __reduce__(self):
+        #a memory-mapped index is re-opened by worker processes, not copied
+        if self.path:
+            return (NameIndex.load, (self.path,))
+        return (NameIndex, (self.blob, self.name_offsets
+            , self.postings_offsets, self.postings))
+
+    def position(self, name):
+        """returns the position of a name in the sorted names or -1"""
+
+        key = name.encode("utf8")
+        i = bisect_left(self._names, key)
+        if i < len(self._names) and self._names[i] == key:
+            return i
+        return -1
+
+    def name(self, i):
+        """returns the i-th name"""
+
+        return self._names[i].decode("utf8")
+
+    def ids(self, i):
+        """returns the geonameids of the i-th name as int32 array"""
+
+        return self.postings[self.postings_offsets[i]:self.postings_offsets[i + 1]]
+
+    def __getitem__(self, name):
+        i = self.position(name)
+        if i == -1:
+            raise KeyError(name)
+        return [str(idx) for idx in self.ids(i)]
+
+    def __contains__(self, name):
+        return self.position(name) != -1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.name(i)
+
+    def __len__(self):
+        return len(self.name_offsets) - 1
@@ -0,0 +1,200 @@
+import os
+import logging
+from array import array
+from collections import Counter
+import numpy as np
+import Levenshtein
+
+
+#padding symbols, names are padded with Q-1 of them at each side
+PAD_LEFT = "\x02"
+PAD_RIGHT = "\x03"
+
+
+def ngrams(name, q=3):
+    """multiset of the q-grams of the padded name, a name of length L has
+    L + q - 1 of them"""
+
+    padded = PAD_LEFT * (q - 1) + name + PAD_RIGHT * (q - 1)
+    return Counter(padded[i:i+q] for i in range(len(padded) - q + 1))
+
+
+class NGramIndex:
+
+    def __init__(self, index, vocab, gram_offsets, post_names, post_counts
+            , lengths, by_length, length_offsets, q=3, path=None):
+        """Character n-gram inverted index over the names of a NameIndex
+
+        Finds all names with minimum Levenshtein distance to a query. For a
+        distance bound k, only names that share enough n-grams with the
+        query (count filter: an edit destroys at most q n-grams, so strings
+        within distance k share at least max(|G1|, |G2|) - k * q n-grams)
+        and whose length differs by at most k are compared with the query.
+        k is doubled until a name within distance k is found, which makes
+        the result exact.
+
+        Args:
+            index (NameIndex): the names the index was built over
+            vocab (np.array): sorted n-grams
+            gram_offsets (np.array): int64, postings of the i-th n-gram are
+                post_names[gram_offsets[i]:gram_offsets[i+1]]
+            post_names (np.array): int32, name positions in index
+            post_counts (np.array): uint16, count of the n-gram in the name
+            lengths (np.array): int32, length of every name
+            by_length (np.array): int32, name positions sorted by length
+            length_offsets (np.array): int64, names with length l are
+                by_length[length_offsets[l]:length_offsets[l+1]]
+            q (int): n
+            path (string): directory the arrays were loaded from, if any
+        """
+        self.index = index
+        self.vocab = vocab
+        self.gram_offsets = gram_offsets
+        self.post_names = post_names
+        self.post_counts = post_counts
+        self.lengths = lengths
+        self.by_length = by_length
+        self.length_offsets = length_offsets
+        self.q = q
+        self.path = path
+        return None
+
+    @classmethod
+    def build(cls, index, q=3):
+        """Builds the n-gram index over all names of a NameIndex"""
+
+        logging.info("building {}-gram index over {} names...".format(q, len(index)))
+        gram2code = {}
+        codes = array("i")
+        names = array("i")
+        counts = array("H")
+        lengths = array("i")
+        for pos in range(len(index)):
+            name = index.name(pos)
+            lengths.append(len(name))
+            for gram, c in ngrams(name, q).items():
+                codes.append(gram2code.setdefault(gram, len(gram2code)))
+                names.append(pos)
+                counts.append(min(c, np.iinfo(np.uint16).max))
+            if pos % 100000 == 0:
+                logging.info("{}/{} names added to {}-gram index".format(pos, len(index), q))
+
+        grams = list(gram2code)
+        order = sorted(range(len(grams)), key=grams.__getitem__)
+        rank = np.empty(len(grams), dtype=np.int64)
+        rank[order] = np.arange(len(grams))
+        vocab = np.array([grams[i] for i in order], dtype="U{}".format(q))
+
+        post_rank = rank[np.frombuffer(codes, dtype=np.int32)]
+        perm = np.argsort(post_rank, kind="stable")
+        gram_offsets = np.concatenate([[0]
+            , np.cumsum(np.bincount(post_rank, minlength=len(grams)))]).astype(np.int64)
+        post_names = np.frombuffer(names, dtype=np.int32)[perm]
+        post_counts = np.frombuffer(counts, dtype=np.uint16)[perm]
+
+        lengths = np.frombuffer(lengths, dtype=np.int32).copy()
+        by_length = np.argsort(lengths, kind="stable").astype(np.int32)
+        length_offsets = np.concatenate([[0]
+            , np.cumsum(np.bincount(lengths, minlength=1))]).astype(np.int64)
+        logging.info("{}-gram index finished, {} n-grams".format(q, len(grams)))
+        return cls(index, vocab, gram_offsets, post_names, post_counts
+                , lengths, by_length, length_offsets, q=q)
+
+    def save(self, path):
+        """writes the arrays to a directory, load with NGramIndex.load"""
+
+        os.makedirs(path, exist_ok=True)
+        for name in ["vocab", "gram_offsets", "post_names", "post_counts"
+                , "lengths", "by_length", "length_offsets"]:
+            np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+        return None
+
+    @classmethod
+    def load(cls, index, path, q=3):
+        """memory maps an index written with save, index must be the
+        NameIndex it was built over"""
+
+        load = lambda name: np.asarray(np.load(os.path.join(path, name + ".npy"), mmap_mode="r"))
+        return cls(index
+                , load("vocab")
+                , load("gram_offsets")
+                , load("post_names")
+                , load("post_counts")
+                , load("lengths")
+                , load("by_length")
+                , load("length_offsets")
+                , q=q
+                , path=path)
+
+    def __reduce__(self):
+        if self.path:
+            return (NGramIndex.load, (self.index, self.path, self.q))
+        return (NGramIndex, (self.index, self.vocab, self.gram_offsets
+            , self.post_names, self.post_counts, self.lengths, self.by_length
+            , self.length_offsets, self.q))
+
+    def _common_ngrams(self, name):
+        """returns name positions and number of shared n-grams (multiset)
+        of all names sharing at least one n-gram with name"""
+
+        ids = []
+        common = []
+        for gram, c in ngrams(name, self.q).items():
+            i = np.searchsorted(self.vocab, gram)
+            if i == len(self.vocab) or self.vocab[i] != gram:
+                continue
+            start, end = self.gram_offsets[i], self.gram_offsets[i + 1]
+            ids.append(self.post_names[start:end])
+            common.append(np.minimum(self.post_counts[start:end], c))
+        if not ids:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+        ids, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        common = np.bincount(inverse, weights=np.concatenate(common)).astype(np.int64)
+        return ids, common
+
+    def _with_length(self, lo, hi):
+        """returns positions of all names with lo <= length <= hi"""
+
+        lo = max(lo, 0)
+        hi = min(hi, len(self.length_offsets) - 2)
+        if lo > hi:
+            return np.zeros(0, dtype=np.int32)
+        return self.by_length[self.length_offsets[lo]:self.length_offsets[hi + 1]]
+
+    def nearest(self, name):
+        """Returns all names with minimum Levenshtein distance to name
+
+        Args:
+            name (string): query
+        Returns:
+            list with names, all have the same (minimal) distance
+            to the query
+        """
+        if not len(self.lengths):
+            return []
+        ids, common = self._common_ngrams(name)
+        id_lengths = self.lengths[ids]
+        n_grams = len(name) + self.q - 1
+        max_length = len(self.length_offsets) - 2
+        dists = {}
+        k = 1
+        while True:
+            #names sharing enough n-grams
+            need = np.maximum(n_grams, id_lengths + self.q - 1) - k * self.q
+            mask = (common >= need) & (np.abs(id_lengths - len(name)) <= k)
+            candidates = ids[mask].tolist()
+            #names sharing no n-gram can only be within distance k if
+            #max(|G1|, |G2|) <= k * q
+            if n_grams <= k * self.q:
+                candidates += self._with_length(len(name) - k
+                        , min(len(name) + k, k * self.q - self.q + 1)).tolist()
+            for pos in candidates:
+                if pos not in dists:
+                    dists[pos] = Levenshtein.distance(name, self.index.name(pos))
+            if dists:
+                md = min(dists.values())
+                if md <= k:
+                    return [self.index.name(pos) for pos, d in dists.items() if d == md]
+            if k > len(name) + max_length:
+                return []
+            k *= 2
@@ -2,7 +2,10 @@ import numpy as np
 import networkx as nx
 from networkx.algorithms.approximation import steinertree
 import logging
-from random import shuffle, choice
+import multiprocessing
+import heapq
+import time
+import random
 from collections import Counter
 
 
@@ -19,7 +22,13 @@ def search(stations
         , C
         , queryobject
         , init_memory=([0.0], [["99999999"]], ["99999999"])
-        , places_in_regests = [[]]):
+        , places_in_regests = [[]]
+        , beam_width=None
+        , beam_margin=None
+        , prune=False
+        , days=None
+        , max_km_per_day=None
+        , infeasible_penalty=1000.0):
     """Search shortest route
     
     Given a list of place names travel stations and a Candidate data base 
@@ -37,6 +46,21 @@ def search(stations
         places_in_regests (list): list of lists with geonameids occuring in 
         charter text that allow us to debugrm the location of charter creation,
             e.g. [ [12,34,2],[0],[1,23,421,12] ]
+        beam_width (int): if given, only the beam_width candidates with
+            lowest cumulative cost of a station are extended to the next
+            station (beam search, faster, but not guaranteed to find the
+            shortest route)
+        beam_margin (float): if given, only candidates with cumulative 
+            cost within this margin of the best candidate are extended
+        prune (bool): compute only transition costs that can be on a
+            shortest route, identical result (see QueryObject.cost_matrix)
+        days (list): (first day, last day) of every station as day numbers 
+            (see data_helpers.regest_days) or None if unknown
+        max_km_per_day (float): if given together with days, transitions
+            longer than max_km_per_day * (days between the stations + 1)
+            are not allowed. If a station cannot be reached at all, its
+            transitions are allowed with cost + infeasible_penalty
+        infeasible_penalty (float): see max_km_per_day
 
     Returns:
         list: list with strings, the predictid geoname ids for the input
@@ -44,8 +68,22 @@ def search(stations
 
     """
 
-    memory={}
-    memory[-1] = init_memory
+    cum_dist, init_pathes, geo_ids_last = init_memory
+    
+    #backpointers[i][j] is the index of the best candidate at t-1 for 
+    #candidate j at t, at t=0 the index of the best init path
+    backpointers = []
+    
+    #candidates of the last station that are extended, None: all
+    active = _beam(cum_dist, beam_width, beam_margin)
+    
+    #runs of a repeated station (with the same helper places) have the 
+    #same cost matrix in every step, and once the cumulative costs 
+    #do not change any more, all further steps of the run are the same
+    run_costs = None
+    fixed_point = False
+    helper_places_last = None
+    max_distance_last = None
     
     #we iterate over the stations
     for i,station in enumerate(stations):
@@ -55,59 +93,44 @@ def search(stations
         geo_ids = C[station]
         
         logging.debug("candidates found: {}".format(len(geo_ids)))
-
-        #we get the cum cost, the possible pathes and the last geoids for 
-        #every candidate from t-1
-        cum_dist, pathes, geo_ids_last = memory[i-1]
-        
-        #we init a matrix to store costs from every candidate at t to 
-        #every candidate from the last step t-1 (plus the cumulative cost
-        #for traveling to t-1) 
-        cdists = np.zeros( (len(geo_ids), len(geo_ids_last)))
-        
-        logging.debug("computing dist mat of shape {}...".format(cdists.shape))
-        # we iterate over candidates of t
-        for j, idx in enumerate(geo_ids):
-            #and we iterate over candidates from t-1
-            for k,idx_last in enumerate(geo_ids_last):
-                #we calculate the cost from a candidate at t to a candidate at t-1
-                if i > 0:
-                    dist = queryobject.cost(stations[i-1], idx_last,station,idx,
-                            helper_places=safe_get(i, places_in_regests) )
-                else:
-                    dist = queryobject._maybe_inform_with_helper_places(idx
-                            , queryobject._compute_feavec(station, idx)
-                            , helper_places=safe_get(i, places_in_regests)
-                            )
-                #and store the cost in the matrix added to the cost that we paid
-                #to traveling to the candidate from the last step
-                cdists[j][k] =cum_dist[k]+ dist 
-        logging.debug("finshed. min cumulative dist {}, max cumulative dist\
-                {}".format(cdists.min(), cdists.max()))
         
-        #for every candidate at t we get the candidate at t-1 with min cost 
-        #for traveling to t via  t-1
-        argmins = cdists.argmin(1)
-        
-        
-        tmpcumdists = []
-        tmppathes = []
-        tmpcoordinates_last = []
-        
-        logging.debug("updating memory t-1 = t")
+        helper_places = safe_get(i, places_in_regests)
+        max_distance = _max_distance(days, i, max_km_per_day)
+        repeat = i > 0 and station == stations[i-1] \
+                and helper_places == helper_places_last \
+                and max_distance == max_distance_last
+        helper_places_last = helper_places
+        max_distance_last = max_distance
+        if not repeat:
+            run_costs = None
+            fixed_point = False
+        elif fixed_point:
+            backpointers.append(backpointers[-1])
+            continue
+        elif run_costs is None and max_distance is None:
+            run_costs = queryobject.cost_matrix(station, geo_ids
+                    , station, geo_ids, helper_places=helper_places)
+
+        cum_dist_last = cum_dist
+        cum_dist, argmins = viterbi_step(queryobject
+                , stations[i-1] if i > 0 else None
+                , geo_ids_last
+                , cum_dist
+                , station
+                , geo_ids
+                , helper_places=helper_places
+                , first=i == 0
+                , active=active
+                , costs=run_costs
+                , prune=prune
+                , max_distance=max_distance
+                , infeasible_penalty=infeasible_penalty)
+        fixed_point = repeat and np.array_equal(cum_dist, cum_dist_last)
         
         #we update now the memory
-        #we iterate over the candidates at t
-        for j in range(cdists.shape[0]):
-            #get the best last candidate at t-1
-            argmin = argmins[j]
-            #update the pathes and cumulative costs
-            tmppathes.append(pathes[argmin]+[j])
-            tmpcumdists.append(cdists[j][argmin])
-            tmpcoordinates_last.append(geo_ids[j])
-        
-        memory[i] = (tmpcumdists, tmppathes, tmpcoordinates_last)
-        memory.pop(i-1)
+        backpointers.append(argmins)
+        geo_ids_last = geo_ids
+        active = _beam(cum_dist, beam_width, beam_margin)
         logging.debug("memory updated")
         if i % 10 == 0:
             logging.debug("placenames resolved: {}/{}".format(i, len(stations)))
@@ -115,9 +138,367 @@ def search(stations
             logging.info("placenames resolved: {}/{}".format(i+1, len(stations)))
 
     logging.debug("finished... returning shortest path")
-    cum_dist, pathes, _ = memory[len(stations)-1]
     amin = np.argmin(cum_dist)
-    return pathes[amin], cum_dist[amin]
+    return _backtrace(backpointers, init_pathes, amin), cum_dist[amin]
+
+
+def viterbi_step(queryobject
+        , station_last
+        , geo_ids_last
+        , cum_dist
+        , station
+        , geo_ids
+        , helper_places=[]
+        , first=False
+        , active=None
+        , costs=None
+        , prune=False
+        , max_distance=None
+        , infeasible_penalty=1000.0):
+    """One step of search: finds for every candidate of a station the 
+    candidate of the last station with min cumulative cost
+
+    Args:
+        queryobject (QueryObject): see search
+        station_last (string): name of the last station
+        geo_ids_last (list): candidates of the last station
+        cum_dist (list): cumulative costs of the candidates of the last station
+        station (string): name of the station
+        geo_ids (list): candidates of the station
+        helper_places (list): geonameids of places in vicinity of the station
+        first (bool): first station, cost is only the distance to helper 
+            places
+        active (np.array): if given, only these candidates of the last 
+            station are considered (sorted indices into geo_ids_last)
+        costs (np.array): if given, the costs from every candidate of the 
+            last station (rows) to every candidate of the station, 
+            otherwise computed with the query object
+        prune (bool): let the query object compute only costs that can
+            give a minimum
+        max_distance (float): if given, only transitions up to this 
+            distance (km) are allowed, if there is none, all are allowed
+            with cost + infeasible_penalty
+        infeasible_penalty (float): see max_distance
+    Returns:
+        np.array: cumulative costs of the candidates of the station
+        np.array: int32, index of the best last candidate for every candidate
+    """
+
+    cum_dist = np.asarray(cum_dist)
+    if active is not None:
+        cum_dist = cum_dist[active]
+        if costs is not None:
+            costs = costs[active]
+
+    #we compute a matrix with costs from every candidate at t to 
+    #every candidate from the last step t-1 (plus the cumulative cost
+    #for traveling to t-1) 
+    logging.debug("computing dist mat of shape {}...".format(
+        (len(geo_ids), len(cum_dist))))
+    if not first:
+        #costs from candidates at t-1 (rows) to candidates at t (columns)
+        if costs is None:
+            costs = queryobject.cost_matrix(station_last, geo_ids_last
+                    , station, geo_ids, helper_places=helper_places, rows=active
+                    , cum_dist=cum_dist if prune else None
+                    , max_distance=max_distance)
+        cdists = cum_dist[None, :] + costs.T
+        if max_distance is not None and not np.isfinite(cdists).any():
+            logging.debug("{} cannot be reached within {} km, using soft \
+                    constraint".format(station, max_distance))
+            costs = queryobject.cost_matrix(station_last, geo_ids_last
+                    , station, geo_ids, helper_places=helper_places, rows=active
+                    , cum_dist=cum_dist if prune else None)
+            cdists = cum_dist[None, :] + (costs.T + infeasible_penalty)
+    else:
+        dists = queryobject.helper_distances(geo_ids
+                , queryobject.feature_matrix(station, geo_ids)
+                , helper_places=helper_places)
+        cdists = cum_dist[None, :] + dists[:, None]
+    logging.debug("finshed. min cumulative dist {}, max cumulative dist\
+            {}".format(cdists.min(), cdists.max()))
+    
+    #for every candidate at t we get the candidate at t-1 with min cost 
+    #for traveling to t via  t-1
+    argmins = cdists.argmin(1)
+    cum_dist = cdists[np.arange(len(geo_ids)), argmins]
+    if active is not None:
+        argmins = active[argmins]
+    return cum_dist, argmins.astype(np.int32)
+
+
+def _beam(cum_dist, beam_width=None, beam_margin=None):
+    """Returns the sorted indices of the candidates that are kept in 
+    beam search, None if all are kept"""
+
+    cum_dist = np.asarray(cum_dist)
+    if beam_width is None and beam_margin is None and np.isfinite(cum_dist).all():
+        return None
+    #unreachable candidates (date constraints) are never extended
+    keep = np.flatnonzero(np.isfinite(cum_dist))
+    if beam_margin is not None and len(keep):
+        keep = keep[cum_dist[keep] <= cum_dist[keep].min() + beam_margin]
+    if beam_width is not None and len(keep) > beam_width:
+        keep = np.sort(keep[np.argsort(cum_dist[keep], kind="stable")[:beam_width]])
+    return keep
+
+
+def _max_distance(days, i, max_km_per_day):
+    """maximum distance in km between station i-1 and i, None if there
+    is no constraint"""
+
+    if not days or not max_km_per_day or i == 0 or not days[i] or not days[i-1]:
+        return None
+    gap = max(days[i][0] - days[i-1][1], 0)
+    return max_km_per_day * (gap + 1)
+
+
+def _backtrace(backpointers, init_pathes, last):
+    """Returns the path ending in candidate last of the last step
+
+    Args:
+        backpointers (list): int arrays, see search
+        init_pathes (list): pathes of the init memory
+        last (int): index of the candidate at the last step
+    Returns:
+        list: the init path followed by candidate indices for every step
+    """
+    path = []
+    j = int(last)
+    for argmins in reversed(backpointers):
+        path.append(j)
+        j = int(argmins[j])
+    return list(init_pathes[j]) + path[::-1]
+
+
+def solve_itinerary(stations, C, queryobject, places_in_regests=[], days=None
+        , coarse_radius=None, **search_args):
+    """Resolves an itinerary with search, starting in any candidate of
+    the first station
+
+    Args:
+        stations (list): list with place names
+        C (dict): candidates, see search
+        queryobject (QueryObject): see search
+        places_in_regests (list): see search
+        days (list): see search
+        coarse_radius (float): if given, decode coarse-to-fine: the
+            candidates of every name are clustered (see cluster_candidates),
+            the itinerary is first solved over the cluster representatives
+            and then over the members of the chosen clusters
+        search_args: further arguments of search (beam_width, beam_margin,
+            prune, max_km_per_day, infeasible_penalty)
+    Returns:
+        list: list with the predicted geoname ids for every station
+        float: cumulative cost of the path
+    """
+    if coarse_radius:
+        clusters = cluster_candidates({name: C[name] for name in set(stations)}
+                , queryobject, radius_km=coarse_radius)
+        coarse = {name: list(clusters[name]) for name in clusters}
+        path, _ = solve_itinerary(stations, coarse, queryobject
+                , places_in_regests=places_in_regests, days=days, **search_args)
+        chosen = {}
+        for name, idx in zip(stations, path):
+            chosen.setdefault(name, set()).update(clusters[name][idx])
+        fine = {name: [idx for idx in C[name] if idx in chosen[name]] for name in chosen}
+        logging.debug("coarse-to-fine: {} -> {} -> {} candidates".format(
+            sum(len(C[name]) for name in chosen), sum(len(coarse[name]) for name in chosen)
+            , sum(len(fine[name]) for name in chosen)))
+        C = fine
+    first = C[stations[0]]
+    path, cum_dist = search(stations
+            , C
+            , queryobject
+            , init_memory=([0.0]*len(first)
+                            , np.full( (len(first),1),-1).tolist()
+                            , first)
+            , places_in_regests=places_in_regests
+            , days=days
+            , **search_args
+            )
+    path = path[1:]
+    return [C[name][path[i]] for i, name in enumerate(stations)], cum_dist
+
+
+def cluster_candidates(C, queryobject, radius_km=10.0):
+    """Clusters the candidates of every name spatially
+
+    The most populous candidate that is not in a cluster yet becomes the
+    representative of a new cluster with all remaining candidates within
+    radius_km, until all candidates are in a cluster.
+
+    Args:
+        C (dict): candidates, see search
+        queryobject (QueryObject): see search
+        radius_km (float): maximum distance of a member to its representative
+    Returns:
+        dict name ---> dict representative ---> list with members 
+        (representatives in order of their population)
+    """
+    clusters = {}
+    for name, geo_ids in C.items():
+        pops = [queryobject._maybe_population(idx) for idx in geo_ids]
+        todo = sorted(range(len(geo_ids)), key=lambda i: -pops[i])
+        clusters[name] = {}
+        while todo:
+            rep = geo_ids[todo[0]]
+            dists = queryobject.distances_to_many(rep, [geo_ids[i] for i in todo])
+            dists[0] = 0.0
+            clusters[name][rep] = [geo_ids[i] for i, d in zip(todo, dists) if d <= radius_km]
+            todo = [i for i, d in zip(todo, dists) if d > radius_km]
+    return clusters
+
+
+def partition_itinerary(keys):
+    """Groups the positions of an itinerary by a key (e.g. the issuer)
+
+    Args:
+        keys (list): a key for every station
+    Returns:
+        list: lists with positions, one list per key, ordered by first 
+        occurrence
+    """
+    parts = {}
+    for i, key in enumerate(keys):
+        parts.setdefault(key, []).append(i)
+    return list(parts.values())
+
+
+#read-only data of an itinerary worker process
+_worker_state = {}
+
+
+def _init_itinerary_worker(C, queryobject, search_args):
+    _worker_state["C"] = C
+    _worker_state["queryobject"] = queryobject
+    _worker_state["search_args"] = search_args
+
+
+def _solve_itinerary_part(task):
+    part, stations, places_in_regests, days = task
+    path, cum_dist = solve_itinerary(stations
+            , _worker_state["C"]
+            , _worker_state["queryobject"]
+            , places_in_regests=places_in_regests
+            , days=days
+            , **_worker_state["search_args"])
+    return part, path, cum_dist
+
+
+def solve_partitioned_itinerary(stations
+        , C
+        , queryobject
+        , keys
+        , places_in_regests=[]
+        , days=None
+        , processes=1
+        , **search_args):
+    """Resolves every part of an itinerary (stations with the same key, 
+    e.g. issuer or collection) as an own chain
+
+    Parts are solved independently, in worker processes if processes > 1,
+    and reassembled to a path over all stations.
+
+    Args:
+        stations (list): list with place names
+        C (dict): candidates, see search
+        queryobject (QueryObject): see search
+        keys (list): a key for every station
+        places_in_regests (list): see search
+        days (list): see search
+        processes (int): number of worker processes. The workers get C and
+            the query object once at start up, not with every part
+        search_args: further arguments of search, see solve_itinerary
+    Returns:
+        list: list with the predicted geoname ids for every station
+        float: sum of the cumulative costs of the parts
+    """
+    parts = partition_itinerary(keys)
+    tasks = [(p, [stations[i] for i in part]
+        , [safe_get(i, places_in_regests) for i in part]
+        , [days[i] for i in part] if days else None)
+        for p, part in enumerate(parts)]
+    #long parts first, they determine the wall-clock time
+    tasks.sort(key=lambda task: len(task[1]), reverse=True)
+    logging.info("solving {} itinerary parts with {} processes".format(
+        len(parts), processes))
+
+    if processes > 1:
+        with multiprocessing.Pool(processes
+                , initializer=_init_itinerary_worker
+                , initargs=(C, queryobject, search_args)) as pool:
+            return _assemble_parts(pool.imap(_solve_itinerary_part, tasks)
+                    , parts, len(stations))
+    
+    _init_itinerary_worker(C, queryobject, search_args)
+    try:
+        return _assemble_parts(map(_solve_itinerary_part, tasks), parts, len(stations))
+    finally:
+        _worker_state.clear()
+
+
+def _assemble_parts(results, parts, n):
+    """reassembles the solved parts (see _solve_itinerary_part) to a path
+    over all n stations"""
+
+    path = [None] * n
+    cum_dist = 0.0
+    for i, (p, part_path, part_cum_dist) in enumerate(results):
+        for j, idx in zip(parts[p], part_path):
+            path[j] = idx
+        cum_dist += part_cum_dist
+        logging.info("{}/{} itinerary parts solved".format(i + 1, len(parts)))
+    return path, cum_dist
+
+
+def beam_report(stations
+        , C
+        , queryobject
+        , beam_widths=[1, 2, 5, 10, 20, 50]
+        , beam_margin=None
+        , places_in_regests=[]
+        , days=None
+        , max_km_per_day=None):
+    """Compares beam search with the exact search on an itinerary
+
+    Args:
+        stations (list): list with place names
+        C (dict): candidates, see search
+        queryobject (QueryObject): see search
+        beam_widths (list): beam widths to compare
+        beam_margin (float): see search
+        places_in_regests (list): see search
+        days (list): see search, both searches use the date constraints
+        max_km_per_day (float): see search
+    Returns:
+        list: a tuple for every beam width with (beam width, number of 
+        stations where the prediction differs from the exact search, 
+        relative cost increase, speedup)
+    """
+    #the first run also fills the feature memory of the query object
+    exact, exact_cost = solve_itinerary(stations, C, queryobject
+            , places_in_regests=places_in_regests
+            , days=days, max_km_per_day=max_km_per_day)
+    t = time.time()
+    solve_itinerary(stations, C, queryobject, places_in_regests=places_in_regests
+            , days=days, max_km_per_day=max_km_per_day)
+    exact_time = time.time() - t
+    out = []
+    for beam_width in beam_widths:
+        t = time.time()
+        path, cost = solve_itinerary(stations, C, queryobject
+                , places_in_regests=places_in_regests
+                , beam_width=beam_width, beam_margin=beam_margin
+                , days=days, max_km_per_day=max_km_per_day)
+        beam_time = time.time() - t
+        diff = sum(1 for idx, idx_exact in zip(path, exact) if idx != idx_exact)
+        increase = (cost - exact_cost) / exact_cost if exact_cost else 0.0
+        out.append((beam_width, diff, float(increase), exact_time / max(beam_time, 1e-9)))
+        logging.info("beam width {}: {}/{} stations differ from exact search, \
+                cost increase {:.2%}, speedup {:.1f}".format(beam_width
+                    , diff, len(stations), increase, out[-1][3]))
+    return out
 
 
 def _retrieve(name, G):
@@ -144,8 +525,7 @@ def maybe_only_one(queryobject, names, idx_charter_location, V):
     if len(names) == 1:
         if idx_charter_location:
 
-            result = [queryobject._vd_by_idx(idx, idx_charter_location[0]) 
-                    for idx in V[0]]
+            result = list(queryobject.distances_to_many(idx_charter_location[0], V[0]))
 
             amin = np.argmin(result)
             return [V[0][amin]], result[amin]
@@ -154,9 +534,10 @@ def maybe_only_one(queryobject, names, idx_charter_location, V):
     return None
 
 
-def gen_partitions(index, n=5): 
-    index = index
-    shuffle(index)
+def gen_partitions(index, n=5, rng=random): 
+    #a shuffled copy, the caller's names keep their order
+    index = list(index)
+    rng.shuffle(index)
     chunks = [index[i:i+n] for i in range(0, len(index), n)]
     if len(chunks[-1]) < n:
         chunks[-2] = chunks[-2] + chunks[-1]
@@ -170,19 +551,21 @@ def topksteiner(names
         , idx_charter_location
         , k=2
         , random_starts=5
-        , n=5):
+        , n=5
+        , rng=random):
 
     score_dict = {names[i]:[] for i in range(len(names))}
     for i in range(random_starts):
         logging.debug("{}/{} random iteration".format(i, random_starts))
-        partitions = gen_partitions(names, n)
+        partitions = gen_partitions(names, n, rng=rng)
         for partition in partitions:
             namesbar = partition
             
             out, _ = determine_with_steiner_tree(namesbar
                     , C
                     , queryobject
-                    , idx_charter_location)
+                    , idx_charter_location
+                    , rng=rng)
 
             for j, name in enumerate(namesbar):
                 score_dict[name]+=[out[j]]
@@ -213,7 +596,8 @@ def determine_with_steiner_tree(names
         , C
         , queryobject
         , idx_charter_location=[]
-        , maxlen=5):
+        , maxlen=5
+        , rng=random):
     
     maybeV, maybesolution, maybecost = _pre_check_and_get_candidates(names
             , C
@@ -238,7 +622,8 @@ def determine_with_steiner_tree(names
                 , idx_charter_location
                 , k=2
                 , random_starts=5
-                , n=maxlen)
+                , n=maxlen
+                , rng=rng)
 
         logging.debug("finished...current workload, \
                 placenamecandidates={},".format([len(x) for x in V]))
@@ -328,7 +713,8 @@ def determine_with_stochastic_arrangement(names
         , C
         , queryobject
         , idx_charter_location=[]
-        , iters=10):
+        , iters=10
+        , rng=random):
     
     maybeV, maybesolution, maybecost = _pre_check_and_get_candidates(names
             ,C
@@ -350,7 +736,7 @@ def determine_with_stochastic_arrangement(names
     for i in range(iters):
         idxsbar = list(range(len(names)))
         if i != 0:
-            shuffle(idxsbar)
+            rng.shuffle(idxsbar)
         namesbar = [names[i] for i in idxsbar]
         path,weight = search(namesbar
                 , C
@@ -397,7 +783,8 @@ def determine_with_hill_climber(names
         , queryobject
         , idx_charter_location=[]
         , post_process_with_search=True
-        , compute_cumulative_weight=False):
+        , compute_cumulative_weight=False
+        , rng=random):
     
     maybeV, maybesolution, maybecost = _pre_check_and_get_candidates(names
             ,C
@@ -464,7 +851,8 @@ def determine_with_hill_climber(names
 def determine_with_random(names
         , C
         , queryobject
-        , idx_charter_location=[]):
+        , idx_charter_location=[]
+        , rng=random):
     
     if not names:
         return [], 0.0
@@ -473,7 +861,7 @@ def determine_with_random(names
     V = [list(set(C[name])) for name in names]
     logging.debug("current workload, placenamecandidates={},".format(
         [len(x) for x in V]))
-    sols = [choice(C[name]) for name in names]
+    sols = [rng.choice(C[name]) for name in names]
     cum_weight = _get_cum_weight(sols
             , graph=None
             , query_object=queryobject
@@ -485,11 +873,87 @@ def determine_with_random(names
     return sols, cum_weight
 
 
+def balanced_chunks(weights, n_chunks):
+    """Splits items into chunks of similar total weight
+
+    Greedy: the heaviest remaining item goes to the lightest chunk.
+
+    Args:
+        weights (list): weight (e.g. work) of every item
+        n_chunks (int): number of chunks
+    Returns:
+        list with lists of item indices (sorted), heaviest chunks first,
+        empty chunks are dropped
+    """
+    heap = [(0, c) for c in range(max(n_chunks, 1))]
+    chunks = [[] for _ in heap]
+    loads = [0] * len(heap)
+    for i in sorted(range(len(weights)), key=lambda i: (-weights[i], i)):
+        load, c = heapq.heappop(heap)
+        chunks[c].append(i)
+        loads[c] = load + weights[i]
+        heapq.heappush(heap, (loads[c], c))
+    order = sorted(range(len(chunks)), key=lambda c: (-loads[c], c))
+    return [sorted(chunks[c]) for c in order if chunks[c]]
+
+
+def _init_text_worker(C, queryobject, method, seed):
+    _worker_state["C"] = C
+    _worker_state["queryobject"] = queryobject
+    _worker_state["method"] = method
+    _worker_state["seed"] = seed
+
+
+def _regest_rng(seed, i):
+    """own random generator of regest i, the same in every process"""
+
+    return random.Random("{}:{}".format(seed, i))
+
+
+def _resolve_text_chunk(task):
+    chunk, namess, helper_placess = task
+    results = []
+    for i, names, helper_places in zip(chunk, namess, helper_placess):
+        results.append(_worker_state["method"](names
+            , _worker_state["C"]
+            , _worker_state["queryobject"]
+            , idx_charter_location=helper_places
+            , rng=_regest_rng(_worker_state["seed"], i)))
+    return chunk, results
+
+
 def resolve_places_in_regests(namess
         , C
         , queryobject
         , charter_location_idxs=[]
-        , method="hillclimber"):
+        , method="hillclimber"
+        , processes=1
+        , chunks_per_process=4
+        , seed=None):
+    """Resolves the place names in the text of every regest
+
+    Args:
+        namess (list): list with place names for every regest
+        C (dict): candidates, see search
+        queryobject (QueryObject): see search
+        charter_location_idxs (list): geonameid of the charter location of 
+            every regest (helper place)
+        method (string): hillclimber, steiner, stochastic or random
+        processes (int): number of worker processes. Regests are 
+            independent, they are solved in chunks of similar work 
+            (sum of the candidate set sizes). Results are in the order 
+            of namess
+        chunks_per_process (int): number of chunks per process
+        seed (int): if given, every regest gets an own random generator
+            seeded with seed and its index (used by the stochastic and 
+            random solvers, and steiner with more than 9 names), results
+            are then the same for any number of processes. None: one
+            process draws from the global generator, worker processes
+            use a seed drawn from it
+    Returns:
+        list: list with predicted geonameids for every regest
+        float: average cost
+    """
 
     helper_placess = [[safe_get(i,charter_location_idxs)] for i in range(len(namess))]
     out=[]
@@ -502,6 +966,31 @@ def resolve_places_in_regests(namess
     elif method == "random":
         method = determine_with_random
 
+    if processes > 1 and seed is None:
+        seed = random.getrandbits(32)
+
+    if processes > 1:
+        weights = [sum(len(C.get(name, [])) for name in names) for names in namess]
+        chunks = balanced_chunks(weights, processes * chunks_per_process)
+        tasks = [(chunk, [namess[i] for i in chunk], [helper_placess[i] for i in chunk])
+                for chunk in chunks]
+        logging.info("resolving places in {} regests in {} chunks with {} \
+                processes".format(len(namess), len(chunks), processes))
+        out = [None] * len(namess)
+        cumcost = [None] * len(namess)
+        done = 0
+        with multiprocessing.Pool(processes
+                , initializer=_init_text_worker
+                , initargs=(C, queryobject, method, seed)) as pool:
+            for chunk, results in pool.imap_unordered(_resolve_text_chunk, tasks):
+                for i, (res, cost) in zip(chunk, results):
+                    out[i] = res
+                    cumcost[i] = cost
+                done += len(chunk)
+                logging.info("{} regests processed (all placenames\
+                        inside text resolved)".format(done))
+        return out, np.mean(cumcost)
+
     cumcost = []
     for i, names in enumerate(namess): 
         
@@ -509,6 +998,7 @@ def resolve_places_in_regests(namess
                 , C
                 , queryobject
                 , idx_charter_location=helper_placess[i]
+                , rng=random if seed is None else _regest_rng(seed, i)
                 )
 
         out.append(res)
@@ -0,0 +1,150 @@
+import logging
+import pickle
+import numpy as np
+from search import viterbi_step, _beam, _max_distance
+
+
+class StreamingSearch:
+
+    def __init__(self, lag=50):
+        """Online version of search for itineraries that grow over time
+
+        Keeps for every chain (e.g. issuer) the Viterbi frontier, i.e.,
+        the cumulative costs of the candidates of the last station, so that
+        new stations (newly crawled regests) can be appended without
+        decoding the whole itinerary again. Decisions for stations that are
+        more than lag stations behind the end of their chain are committed
+        (fixed-lag decoding) and their backpointers are dropped, only the
+        tail of a chain can still change when stations are appended.
+
+        Args:
+            lag (int): number of stations after which a decision is
+                committed, None keeps all backpointers (same result as
+                search, but memory grows with the itinerary)
+        """
+        self.lag = lag
+        self.chains = {}
+        self.uris = {}
+        return None
+
+    @classmethod
+    def load(cls, path):
+        """loads a decoder written with save"""
+
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+        return None
+
+    def known(self, uri):
+        """True if the regest with this uri was already appended"""
+
+        return uri in self.uris
+
+    def _new_chain(self, key):
+        chain = {
+                #geonameids of committed stations
+                "committed": []
+                #candidate lists and backpointers of the uncommitted stations
+                , "tail": []
+                , "backpointers": []
+                #frontier
+                , "station": None
+                , "cum_dist": np.zeros(1)
+                #(first day, last day) of the last station
+                , "day": None
+                , "uris": []
+                }
+        self.chains[key] = chain
+        return chain
+
+    def extend(self, stations, uris, C, queryobject, keys=None, places_in_regests=[]
+            , days=None, beam_width=None, beam_margin=None, prune=False
+            , max_km_per_day=None, infeasible_penalty=1000.0):
+        """Appends stations to their chains and decodes them
+
+        Args:
+            stations (list): place names, sorted by date
+            uris (list): regest uri of every station
+            C (dict): candidates, see search.search
+            queryobject (QueryObject): see search.search
+            keys (list): chain of every station, e.g. the issuer,
+                None puts all stations in one chain
+            places_in_regests (list): list of lists with geonameids of places
+                in the text of every station
+            days (list): (first day, last day) of every station or None,
+                see search.search
+            beam_width (int): see search.search
+            beam_margin (float): see search.search
+            prune (bool): see search.search
+            max_km_per_day (float): see search.search, applied between
+                consecutive stations of a chain
+            infeasible_penalty (float): see search.search
+        """
+        for i, station in enumerate(stations):
+            key = keys[i] if keys else ""
+            chain = self.chains.get(key) or self._new_chain(key)
+            first = chain["station"] is None
+            day = days[i] if days else None
+            max_distance = None
+            if not first:
+                max_distance = _max_distance([chain.get("day"), day], 1, max_km_per_day)
+            cum_dist, argmins = viterbi_step(queryobject
+                    , chain["station"]
+                    , chain["tail"][-1] if chain["tail"] else []
+                    , chain["cum_dist"]
+                    , station
+                    , C[station]
+                    , helper_places=places_in_regests[i] if places_in_regests else []
+                    , first=first
+                , active=None if first else _beam(chain["cum_dist"], beam_width, beam_margin)
+                , prune=prune
+                , max_distance=max_distance
+                , infeasible_penalty=infeasible_penalty)
+            chain["tail"].append(list(C[station]))
+            chain["backpointers"].append(argmins)
+            chain["station"] = station
+            chain["cum_dist"] = cum_dist
+            chain["day"] = day
+            chain["uris"].append(uris[i])
+            self.uris[uris[i]] = key
+            if self.lag is not None and len(chain["tail"]) > 2 * self.lag + 1:
+                self._commit(chain, len(chain["tail"]) - self.lag - 1)
+            if (i + 1) % 100 == 0:
+                logging.info("placenames appended: {}/{}".format(i+1, len(stations)))
+        return None
+
+    def _backtrace(self, chain):
+        """returns the geonameids of the best path through the tail"""
+
+        j = int(np.argmin(chain["cum_dist"]))
+        idxs = []
+        for argmins in reversed(chain["backpointers"]):
+            idxs.append(j)
+            j = int(argmins[j])
+        return [geo_ids[j] for geo_ids, j in zip(chain["tail"], reversed(idxs))]
+
+    def _commit(self, chain, n):
+        """commits the decisions for the first n stations of the tail"""
+
+        chain["committed"] += self._backtrace(chain)[:n]
+        chain["tail"] = chain["tail"][n:]
+        chain["backpointers"] = chain["backpointers"][n:]
+        return None
+
+    def predictions(self):
+        """Returns the dict uri ---> predicted geonameid for all stations"""
+
+        out = {}
+        for chain in self.chains.values():
+            path = chain["committed"] + self._backtrace(chain)
+            out.update(zip(chain["uris"], path))
+        return out
+
+    def cost(self):
+        """Returns the sum of the cumulative costs of all chains"""
+
+        return sum(float(np.min(chain["cum_dist"])) for chain in self.chains.values())
@@ -1,4 +1,5 @@
 import logging
+from collections import OrderedDict
 
 def int2loglevel(i):
     if i == 0:
@@ -7,3 +8,59 @@ def int2loglevel(i):
         return logging.INFO
     elif i == 2:
         return logging.DEBUG
+
+
+class LRUCache:
+
+    def __init__(self, maxsize=128, weight=None):
+        """Dictionary with at most maxsize entries, the least recently 
+        used entries are dropped when a new one is added to a full cache
+
+        Args:
+            maxsize (int): maximum number of entries, or maximum total
+                weight if weight is given, 0 disables the cache
+            weight (function): value ---> size of an entry (e.g. bytes),
+                None: every entry has size 1
+        """
+        self.maxsize = maxsize
+        self.weight = weight
+        self.size = 0
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        return None
+
+    def get(self, key, default=None):
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.hits += 1
+            return self.data[key]
+        self.misses += 1
+        return default
+
+    def _weight(self, value):
+        return self.weight(value) if self.weight is not None else 1
+
+    def put(self, key, value):
+        size = self._weight(value)
+        if self.maxsize <= 0 or size > self.maxsize:
+            return None
+        if key in self.data:
+            self.size -= self._weight(self.data.pop(key))
+        self.data[key] = value
+        self.size += size
+        while self.size > self.maxsize:
+            _, dropped = self.data.popitem(last=False)
+            self.size -= self._weight(dropped)
+        return None
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+        self.size = 0
+        return None